@@ -0,0 +1,106 @@
+from contextlib import closing, contextmanager
+from pathlib import Path
+import json
+import sqlite3
+import time
+import zlib
+
+
+class ParseCache:
+    """SQLite side-store of the cells parsed from each notebook, keyed by the parser version and notebook checksum.
+
+    Entries are zlib-compressed JSON lists of cells; when the total size exceeds max_size,
+    the least recently used entries are evicted.
+
+    Each call opens its own connection, so that the cache can be used from any thread or process,
+    and the file is only created on the first put().
+    """
+
+    def __init__(self, path, max_size=64 * 2 ** 20):
+        """
+        Arguments:
+            path {str|Path} -- Path to the SQLite file, created if not exists
+
+        Keyword Arguments:
+            max_size {int} -- Maximal total size of the compressed entries, in bytes (default: {64 MiB})
+        """
+
+        self.path = Path(path).expanduser()
+        self.max_size = max_size
+
+    def get(self, checksum):
+        """
+        Arguments:
+            checksum {str} -- '<util.PARSER_VERSION>:<db.File.checksum>'
+
+        Returns:
+            list -- List of cells, or None if not cached
+        """
+
+        if not self.path.exists():
+            return None
+
+        with self._connect() as conn:
+            row = conn.execute('SELECT payload FROM parse_cache WHERE checksum = ?', (checksum,)).fetchone()
+            if row is None:
+                return None
+
+            conn.execute('UPDATE parse_cache SET accessed = ? WHERE checksum = ?', (time.time(), checksum))
+
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def put(self, checksum, cells):
+        """
+        Arguments:
+            checksum {str} -- '<util.PARSER_VERSION>:<db.File.checksum>'
+            cells {list} -- List of cells, as parsed by util.parse_jupyter()
+        """
+
+        payload = zlib.compress(json.dumps(cells).encode('utf-8'))
+        if len(payload) > self.max_size:
+            return
+
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO parse_cache (checksum, payload, size, accessed) '
+                         'VALUES (?, ?, ?, ?)', (checksum, payload, len(payload), time.time()))
+            self._evict(conn)
+
+    def clear(self):
+        if not self.path.exists():
+            return
+
+        with self._connect() as conn:
+            conn.execute('DELETE FROM parse_cache')
+
+    @contextmanager
+    def _connect(self):
+        """A transaction on a new connection, which is closed afterwards"""
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with closing(sqlite3.connect(str(self.path), timeout=30)) as conn:
+            with conn:
+                conn.execute('''
+                CREATE TABLE IF NOT EXISTS parse_cache (
+                    checksum    TEXT PRIMARY KEY,
+                    payload     BLOB NOT NULL,
+                    size        INTEGER NOT NULL,
+                    accessed    REAL NOT NULL
+                )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS ix_parse_cache_accessed ON parse_cache (accessed)')
+
+                yield conn
+
+    def _evict(self, conn):
+        total_size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM parse_cache').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        for checksum, size in conn.execute('SELECT checksum, size FROM parse_cache '
+                                           'ORDER BY accessed').fetchall():
+            conn.execute('DELETE FROM parse_cache WHERE checksum = ?', (checksum,))
+            total_size -= size
+
+            if total_size <= self.max_size:
+                break
@@ -1,8 +1,14 @@
 import os
 from datetime import timedelta
+from pathlib import Path
 
 config = {
     'engine': 'postgresql://localhost/jupyter-flashcard',
+    'user': 'default',
+    'parse_cache_path': str(Path.home().joinpath('.jupyter-flashcard', 'parse-cache.sqlite')),
+    'parse_cache_size': 64 * 2 ** 20,
+    'sqlite_timeout': 30,
+    'busy_retries': 5,
     'host': 'localhost',
     'port': 7000,
     'debug': False,
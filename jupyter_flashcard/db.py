@@ -1,21 +1,58 @@
 from datetime import datetime, timedelta
 from pathlib import Path
-import hashlib
+import functools
 import logging
+import random
+import time
 
 import IPython.display
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, object_session, relationship, undefer
 import sqlalchemy as sa
 
 from .config import config
-from .util import complete_path_split, get_files, read_jupyter
+from .util import complete_path_split, get_files, get_checksum, is_checksum, parse_jupyter, PARSER_VERSION
 from .enum import FlashcardCellType, CellType
 
 Base = declarative_base()
 
 
+def retry_on_locked(func):
+    """Retry a write, with exponential backoff, if the database is locked by another process (SQLite)
+
+    The rollback discards all pending changes of the session, so only decorate the outermost unit of work,
+    and let it call undecorated helpers (e.g. Flashcard.wrong() calls Flashcard._bury(), not Flashcard.bury()).
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for i in range(config['busy_retries']):
+            try:
+                return func(*args, **kwargs)
+            except sa.exc.OperationalError as e:
+                if 'locked' not in str(e.orig) and 'busy' not in str(e.orig):
+                    raise
+
+                _get_session(args[0]).rollback()
+                logging.warning('Database is locked, retrying %s', func.__name__)
+                time.sleep(0.05 * 2 ** i * random.uniform(1, 2))
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _get_session(obj):
+    """The session of an ORM instance, e.g. of the JupyterFlashcard it was queried from,
+    or of a JupyterFlashcard itself, else the latest session"""
+
+    try:
+        return object_session(obj) or config['session']
+    except sa.orm.exc.UnmappedInstanceError:
+        return getattr(obj, 'session', None) or config['session']
+
+
 class Flashcard(Base):
     __tablename__ = 'flashcard'
 
@@ -23,11 +60,47 @@ class Flashcard(Base):
     modified = sa.Column(sa.DateTime, server_default=sa.func.now(), server_onupdate=sa.func.now())
     flashcard_cell_connects = relationship('FlashcardCellConnect', order_by='FlashcardCellConnect.id',
                                            back_populates='flashcard')
+    reviews = relationship('Review', back_populates='flashcard', cascade='all, delete-orphan')
 
-    srs_level = sa.Column(sa.Integer, server_default='0')
-    next_review = sa.Column(sa.DateTime, server_default=sa.func.now())
     tags_str = sa.Column(sa.String(100))
 
+    rendered = None
+
+    @property
+    def user(self):
+        return _get_session(self).info.get('user', config['user'])
+
+    @property
+    def review(self):
+        user = self.user
+
+        db_review = _get_session(self).query(Review).get((user, self.id))
+        if db_review is None:
+            db_review = Review(user_id=user, flashcard_id=self.id,
+                               srs_level=0, next_review=datetime.now())
+
+        return db_review
+
+    @property
+    def srs_level(self):
+        return self.review.srs_level
+
+    @srs_level.setter
+    def srs_level(self, value):
+        db_review = self.review
+        db_review.srs_level = value
+        _get_session(self).add(db_review)
+
+    @property
+    def next_review(self):
+        return self.review.next_review
+
+    @next_review.setter
+    def next_review(self, value):
+        db_review = self.review
+        db_review.next_review = value
+        _get_session(self).add(db_review)
+
     @property
     def fronts(self):
         return list(self._iter_cell(FlashcardCellType.FRONT))
@@ -67,51 +140,68 @@ class Flashcard(Base):
         result_set = set()
 
         for db_cell in self.cells:
-            result_set.update(db_cell.filename)
+            result_set.add(db_cell.filename)
 
         return list(result_set)
 
     @classmethod
-    def add(cls, front_ids, back_ids, extra_ids=None):
+    def add(cls, front_ids, back_ids, extra_ids=None, commit=True, session=None):
+        if session is None:
+            session = config['session']
+
         db_flashcard = cls()
-        config['session'].add(db_flashcard)
-        config['session'].commit()
+        session.add(db_flashcard)
+        session.flush()
 
         if extra_ids is None:
             extra_ids = list()
 
-        FlashcardCellConnect.add_from_cell_ids(front_ids, FlashcardCellType.FRONT, db_flashcard)
-        FlashcardCellConnect.add_from_cell_ids(back_ids, FlashcardCellType.BACK, db_flashcard)
-        FlashcardCellConnect.add_from_cell_ids(extra_ids, FlashcardCellType.EXTRA, db_flashcard)
+        FlashcardCellConnect.add_from_cell_ids(front_ids, FlashcardCellType.FRONT, db_flashcard, commit=False)
+        FlashcardCellConnect.add_from_cell_ids(back_ids, FlashcardCellType.BACK, db_flashcard, commit=False)
+        FlashcardCellConnect.add_from_cell_ids(extra_ids, FlashcardCellType.EXTRA, db_flashcard, commit=False)
 
+        if commit:
+            Review.add_missing(session, flashcard_ids=[db_flashcard.id])
+            session.commit()
+
+        return db_flashcard
+
+    @retry_on_locked
     def add_tags(self, tags=('marked',)):
+        self._add_tags(tags)
+
+    def _add_tags(self, tags):
         if isinstance(tags, str):
             tag = tags
             if tag not in self.tags:
                 my_tags = self.my_tags
                 my_tags.append(tag)
                 self.tags_str = '\n'.join(my_tags)
-                config['session'].commit()
+                _get_session(self).commit()
         else:
             for tag in tags:
-                self.add_tags(tag)
+                self._add_tags(tag)
 
+    @retry_on_locked
     def remove_tags(self, tags=('marked',), recursive=False):
+        self._remove_tags(tags, recursive)
+
+    def _remove_tags(self, tags, recursive=False):
         if isinstance(tags, str):
             tag = tags
             my_tags = self.my_tags
             if tag in my_tags:
                 my_tags.remove(tag)
                 self.tags_str = '\n'.join(my_tags)
-                config['session'].commit()
+                _get_session(self).commit()
             else:
                 if recursive:
                     for cell in self.cells:
                         if tag in cell.tags:
-                            cell.remove_tags(tag)
+                            cell._remove_tags(tag)
         else:
             for tag in tags:
-                self.remove_tags(tag)
+                self._remove_tags(tag)
 
     mark = add_tags
     unmark = remove_tags
@@ -140,50 +230,81 @@ class Flashcard(Base):
             else:
                 yield fcc.cell
 
+    def _pop_rendered(self, type_):
+        """Each side pre-rendered by quiz.PrefetchQuiz is displayed once; later, it is loaded from the database"""
+
+        if not self.rendered:
+            return None
+
+        rendered = self.rendered.pop(type_, None)
+        if not self.rendered:
+            self.rendered = None
+
+        return rendered
+
     def _repr_html_(self):
         self.hide()
 
         return ''
 
     def show(self):
-        for db_cell in self.backs:
-            IPython.display.display(db_cell)
+        rendered = self._pop_rendered(FlashcardCellType.BACK)
+        if rendered is not None:
+            IPython.display.display(*rendered, raw=True)
+        else:
+            db_cells = Cell.load_data(self.backs)
+            for db_cell in db_cells:
+                IPython.display.display(db_cell)
 
     def hide(self):
-        for db_cell in self.fronts:
-            IPython.display.display(db_cell)
+        rendered = self._pop_rendered(FlashcardCellType.FRONT)
+        if rendered is not None:
+            IPython.display.display(*rendered, raw=True)
+        else:
+            db_cells = Cell.load_data(self.fronts)
+            for db_cell in db_cells:
+                IPython.display.display(db_cell)
 
+    @retry_on_locked
     def right(self):
-        if not self.srs_level:
-            self.srs_level = 1
-        else:
-            self.srs_level = self.srs_level + 1
+        db_review = self.review
 
-        self.next_review = (datetime.now()
-                            + config['srs'].get(int(self.srs_level), timedelta(weeks=4)))
+        if not db_review.srs_level:
+            db_review.srs_level = 1
+        else:
+            db_review.srs_level = db_review.srs_level + 1
 
-        for slide in self._iter_cell():
-            slide.modified = datetime.now()
+        db_review.next_review = (datetime.now()
+                                 + config['srs'].get(int(db_review.srs_level), timedelta(weeks=4)))
 
-        config['session'].commit()
+        _get_session(self).add(db_review)
+        _get_session(self).commit()
 
     correct = next_srs = right
 
+    @retry_on_locked
     def wrong(self, duration=timedelta(minutes=1)):
-        if self.srs_level and self.srs_level > 1:
-            self.srs_level = self.srs_level - 1
+        db_review = self.review
 
-        return self.bury(duration)
+        if db_review.srs_level and db_review.srs_level > 1:
+            db_review.srs_level = db_review.srs_level - 1
+
+        _get_session(self).add(db_review)
+
+        return self._bury(duration)
 
     incorrect = previous_srs = wrong
 
+    @retry_on_locked
     def bury(self, duration=timedelta(hours=4)):
-        self.next_review = datetime.now() + duration
+        self._bury(duration)
 
-        for slide in self._iter_cell():
-            slide.modified = datetime.now()
+    def _bury(self, duration):
+        db_review = self.review
+        db_review.next_review = datetime.now() + duration
 
-        config['session'].commit()
+        _get_session(self).add(db_review)
+        _get_session(self).commit()
 
 
 class Cell(Base):
@@ -192,8 +313,8 @@ class Cell(Base):
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     modified = sa.Column(sa.DateTime, server_default=sa.func.now(), server_onupdate=sa.func.now())
 
-    data = sa.Column(sa.String(50000), nullable=False)
-    file_id = sa.Column(sa.Integer, sa.ForeignKey('file.id'), nullable=False)
+    data = deferred(sa.Column(sa.String(50000), nullable=False))
+    file_id = sa.Column(sa.Integer, sa.ForeignKey('file.id'), nullable=False, index=True)
     tags_str = sa.Column(sa.String(100))
 
     file_ = relationship('File', back_populates='cells')
@@ -225,43 +346,77 @@ class Cell(Base):
         return self.file_.name
 
     @classmethod
-    def add(cls, data, file_):
+    def add(cls, data, file_, commit=True):
         db_cell = cls()
         db_cell.data = data
         db_cell.file_id = file_.id
 
-        config['session'].add(db_cell)
-        config['session'].commit()
+        session = _get_session(file_)
+        session.add(db_cell)
+        if commit:
+            session.commit()
+        else:
+            session.flush()
 
         return db_cell
 
+    @classmethod
+    def load_data(cls, db_cells):
+        """Load the deferred data of many cells in one query, before displaying or searching them
+
+        Arguments:
+            db_cells {iterable} -- Iterable of db.Cell
+
+        Returns:
+            list -- db_cells, as a list
+        """
+
+        db_cells = list(db_cells)
+        cell_ids = [db_cell.id for db_cell in db_cells if 'data' in sa.inspect(db_cell).unloaded]
+        if not cell_ids:
+            return db_cells
+
+        session = _get_session(db_cells[0])
+        for i in range(0, len(cell_ids), 500):
+            session.query(cls).options(undefer(cls.data)).filter(cls.id.in_(cell_ids[i:i + 500])).all()
+
+        return db_cells
+
+    @retry_on_locked
     def add_tags(self, tags=('marked',)):
+        self._add_tags(tags)
+
+    def _add_tags(self, tags):
         if isinstance(tags, str):
             tag = tags
             if tag not in self.tags:
                 my_tags = self.my_tags
                 my_tags.append(tag)
                 self.tags_str = '\n'.join(my_tags)
-                config['session'].commit()
+                _get_session(self).commit()
         else:
             for tag in tags:
-                self.add_tags(tag)
+                self._add_tags(tag)
 
+    @retry_on_locked
     def remove_tags(self, tags=('marked',), recursive=False):
+        self._remove_tags(tags, recursive)
+
+    def _remove_tags(self, tags, recursive=False):
         if isinstance(tags, str):
             tag = tags
             my_tags = self.my_tags
             if tag in my_tags:
                 my_tags.remove(tag)
                 self.tags_str = '\n'.join(my_tags)
-                config['session'].commit()
+                _get_session(self).commit()
             else:
                 if recursive:
                     if tag in self.file_.tags:
-                        self.file_.remove_tags(tag)
+                        self.file_._remove_tags(tag)
         else:
             for tag in tags:
-                self.remove_tags(tag)
+                self._remove_tags(tag)
 
     mark = add_tags
     unmark = remove_tags
@@ -287,7 +442,7 @@ class File(Base):
     __tablename__ = 'file'
 
     id = sa.Column(sa.Integer, primary_key=True)
-    name = sa.Column(sa.String(100), nullable=False)
+    name = sa.Column(sa.String(100), nullable=False, index=True)
     checksum = sa.Column(sa.String, nullable=False)
     updated = sa.Column(sa.DateTime, server_default=sa.func.now(), server_onupdate=sa.func.now())
     tags_str = sa.Column(sa.String(100))
@@ -316,34 +471,42 @@ class File(Base):
 
         return list(tags_set)
 
+    @retry_on_locked
     def add_tags(self, tags=('marked',)):
+        self._add_tags(tags)
+
+    def _add_tags(self, tags):
         if isinstance(tags, str):
             tag = tags
             if tag not in self.tags:
                 my_tags = self.my_tags
                 my_tags.append(tag)
                 self.tags_str = '\n'.join(my_tags)
-                config['session'].commit()
+                _get_session(self).commit()
         else:
             for tag in tags:
-                self.add_tags(tag)
+                self._add_tags(tag)
 
+    @retry_on_locked
     def remove_tags(self, tags=('marked',), recursive=False):
+        self._remove_tags(tags, recursive)
+
+    def _remove_tags(self, tags, recursive=False):
         if isinstance(tags, str):
             tag = tags
             my_tags = self.my_tags
             if tag in my_tags:
                 my_tags.remove(tag)
                 self.tags_str = '\n'.join(my_tags)
-                config['session'].commit()
+                _get_session(self).commit()
             else:
                 if recursive:
                     for cell in self.cells:
                         if tag in cell.tags:
-                            cell.remove_tags(tag)
+                            cell._remove_tags(tag)
         else:
             for tag in tags:
-                self.remove_tags(tag)
+                self._remove_tags(tag)
 
     mark = add_tags
     unmark = remove_tags
@@ -361,96 +524,147 @@ class File(Base):
         return repr(self.to_dict())
 
     @classmethod
-    def add(cls, file_path):
+    def add(cls, file_path, session=None):
+        if session is None:
+            session = config['session']
+
         file_path = Path(file_path).resolve()
 
         if file_path.is_dir():
             for fp in get_files(suffixes=['.ipynb'], src=file_path):
-                cls.add(fp)
+                cls.add(fp, session=session)
         else:
             file_id = file_path.stat().st_ino
-            db_file = config['session'].query(cls).filter_by(id=file_id).first()
+            db_file = session.query(cls).filter_by(id=file_id).first()
             if db_file is None:
                 db_file = cls()
                 db_file.id = file_id
                 db_file.name = str(file_path.resolve())
-                db_file.checksum = hashlib.md5(file_path.read_bytes()).hexdigest()
+                raw = file_path.read_bytes()
+                db_file.checksum = ''
                 db_file.tags_str = '\n'.join(complete_path_split(file_path.parent))
 
-                config['session'].add(db_file)
-                config['session'].commit()
+                session.add(db_file)
+                session.commit()
 
-                db_file.update(forced=True)
+                db_file.update(forced=True, raw=raw)
             else:
                 logging.error('%s already exists.', file_path)
 
     def _repr_html_(self):
-        for db_cell in self.cells:
+        for db_cell in Cell.load_data(self.cells):
             IPython.display.display(db_cell)
 
         return ''
 
-    def is_updated(self):
+    @staticmethod
+    def _parse(raw, checksum):
+        parse_cache = config.get('parse_cache')
+        if parse_cache is None:
+            return list(parse_jupyter(raw))
+
+        key = '{}:{}'.format(PARSER_VERSION, checksum)
+
+        cells = parse_cache.get(key)
+        if cells is None:
+            cells = list(parse_jupyter(raw))
+            parse_cache.put(key, cells)
+
+        return cells
+
+    def is_updated(self, raw=None):
         if self.path.exists() and self.path.stat().st_ino == self.id:
-            if self.checksum != hashlib.md5(self.path.read_bytes()).hexdigest():
-                return False
-            else:
-                return True
+            if raw is None:
+                raw = self.path.read_bytes()
+
+            return is_checksum(self.checksum, raw)
         else:
             return None
 
-    def update(self, forced=False):
+    @retry_on_locked
+    def update(self, forced=False, raw=None):
         if not forced:
-            update_status = self.is_updated()
+            if raw is None and self.path.exists():
+                raw = self.path.read_bytes()
+
+            update_status = self.is_updated(raw)
         else:
             update_status = False
 
+        session = _get_session(self)
+
         if update_status is None:
-            config['session'].delete(self)
-            config['session'].commit()
+            session.delete(self)
+            session.commit()
         elif update_status is False:
-            fc = dict()
-            for cell_data in read_jupyter(self.path):
-                do_add = True
-
-                for db_cell in config['session'].query(Cell).filter_by(file_id=self.id):
-                    if cell_data != db_cell.data:
-                        if db_cell.data in cell_data:
-                            do_add = False
-
-                            db_cell.data = cell_data
-                            config['session'].commit()
-                    else:
-                        do_add = False
-
-                if do_add:
-                    db_cell = config['session'].query(Cell).filter_by(data=cell_data).first()
-                    if db_cell:
-                        logging.error('Cannot import cell %s from file %s due to duplicate with %s',
-                                      cell_data, self.path, db_cell.filename)
-                        return
-                    else:
-                        db_cell = Cell.add(data=cell_data, file_=self)
+            if raw is None:
+                raw = self.path.read_bytes()
 
-                        if cell_data[0] == '#':
-                            if len(fc) >= 2:
-                                Flashcard.add(**fc)
-                                fc = dict()
+            checksum = get_checksum(raw)
 
-                            fc.setdefault('front_ids', []).append(db_cell.id)
-                        elif 'front_ids' in fc.keys():
-                            fc.setdefault('back_ids', []).append(db_cell.id)
+            try:
+                if self._import_cells(self._parse(raw, checksum)):
+                    self.checksum = checksum
 
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
         else:
             logging.info('%s is already updated', self.path)
 
+    def _import_cells(self, cells):
+        """Add new cells and flashcards, and update changed cells, without committing
+
+        Returns:
+            bool -- False, if the import stopped at a duplicate cell
+        """
+
+        session = _get_session(self)
+
+        flashcard_ids = list()
+        fc = dict()
+        for cell_data in cells:
+            do_add = True
+
+            for db_cell in session.query(Cell).options(undefer(Cell.data)).filter_by(file_id=self.id):
+                if cell_data != db_cell.data:
+                    if db_cell.data in cell_data:
+                        do_add = False
+
+                        db_cell.data = cell_data
+                else:
+                    do_add = False
+
+            if do_add:
+                db_cell = session.query(Cell).filter_by(data=cell_data).first()
+                if db_cell:
+                    logging.error('Cannot import cell %s from file %s due to duplicate with %s',
+                                  cell_data, self.path, db_cell.filename)
+                    Review.add_missing(session, flashcard_ids=flashcard_ids)
+                    return False
+                else:
+                    db_cell = Cell.add(data=cell_data, file_=self, commit=False)
+
+                    if cell_data[0] == '#':
+                        if len(fc) >= 2:
+                            flashcard_ids.append(Flashcard.add(**fc, commit=False, session=session).id)
+                            fc = dict()
+
+                        fc.setdefault('front_ids', []).append(db_cell.id)
+                    elif 'front_ids' in fc.keys():
+                        fc.setdefault('back_ids', []).append(db_cell.id)
+
+        Review.add_missing(session, flashcard_ids=flashcard_ids)
+        return True
+
 
 class FlashcardCellConnect(Base):
     __tablename__ = 'flashcard_cell_connect'
 
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
-    flashcard_id = sa.Column(sa.Integer, sa.ForeignKey('flashcard.id'), nullable=False)
-    cell_id = sa.Column(sa.Integer, sa.ForeignKey('cell.id'), nullable=False)
+    flashcard_id = sa.Column(sa.Integer, sa.ForeignKey('flashcard.id'), nullable=False, index=True)
+    cell_id = sa.Column(sa.Integer, sa.ForeignKey('cell.id'), nullable=False, index=True)
     type_ = sa.Column(sa.String(10), nullable=False)
 
     flashcard = relationship('Flashcard', back_populates='flashcard_cell_connects')
@@ -468,12 +682,91 @@ class FlashcardCellConnect(Base):
         return repr(self.to_dict())
 
     @classmethod
-    def add_from_cell_ids(cls, cell_ids, type_, db_flashcard):
+    def add_from_cell_ids(cls, cell_ids, type_, db_flashcard, commit=True):
         for cell_id in cell_ids:
             db_fcc = cls()
             db_fcc.flashcard_id = db_flashcard.id
             db_fcc.cell_id = cell_id
             db_fcc.type_ = type_
 
-            config['session'].add(db_fcc)
-            config['session'].commit()
+            _get_session(db_flashcard).add(db_fcc)
+
+        if commit:
+            _get_session(db_flashcard).commit()
+
+
+class Review(Base):
+    __tablename__ = 'review'
+
+    user_id = sa.Column(sa.String(100), primary_key=True)
+    flashcard_id = sa.Column(sa.Integer, sa.ForeignKey('flashcard.id'), primary_key=True)
+    modified = sa.Column(sa.DateTime, server_default=sa.func.now(), onupdate=datetime.now)
+
+    srs_level = sa.Column(sa.Integer, nullable=False, default=0, server_default='0')
+    next_review = sa.Column(sa.DateTime, nullable=False, default=datetime.now, server_default=sa.func.now())
+
+    flashcard = relationship('Flashcard', back_populates='reviews')
+
+    __table_args__ = (
+        sa.Index('ix_review_user_id_next_review', 'user_id', 'next_review'),
+    )
+
+    @classmethod
+    def add_missing(cls, session, users=None, flashcard_ids=None):
+        """Add the reviews, due now, of flashcards that a learner has not seen yet, without committing.
+
+        Every flashcard has a review of every learner, so that due flashcards are
+        a range of ix_review_user_id_next_review, rather than an outer join on all flashcards.
+
+        Arguments:
+            session {sqlalchemy.orm.Session} -- Session to add to
+
+        Keyword Arguments:
+            users {iterable} -- Learners, or None for all learners with reviews, and the learner of the session
+                (default: {None})
+            flashcard_ids {iterable} -- db.Flashcard.id's, or None for all flashcards (default: {None})
+        """
+
+        if users is None:
+            users = {user for user, in session.query(cls.user_id).distinct()}
+            users.add(session.info.get('user', config['user']))
+
+        if flashcard_ids is not None:
+            flashcard_ids = list(flashcard_ids)
+            if not flashcard_ids:
+                return
+
+        review = cls.__table__
+        flashcard = Flashcard.__table__
+        now = datetime.now()
+
+        for user in users:
+            query = sa.select([sa.literal(user),
+                               flashcard.c.id,
+                               sa.literal(0),
+                               sa.literal(now, sa.DateTime)]) \
+                .where(sa.not_(sa.exists().where(sa.and_(review.c.user_id == user,
+                                                        review.c.flashcard_id == flashcard.c.id))))
+            if flashcard_ids is not None:
+                query = query.where(flashcard.c.id.in_(flashcard_ids))
+
+            session.execute(review.insert().from_select(
+                ['user_id', 'flashcard_id', 'srs_level', 'next_review'], query))
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'flashcard_id': self.flashcard_id,
+            'srs_level': self.srs_level,
+            'next_review': self.next_review.isoformat()
+        }
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version = sa.Column(sa.Integer, primary_key=True)
+    upgraded = sa.Column(sa.DateTime, server_default=sa.func.now())
@@ -2,10 +2,17 @@ from datetime import datetime, timedelta
 import random
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.orm import selectinload, sessionmaker, undefer
+import sqlalchemy as sa
 
-from . import db
+from . import db, migrate
+from .cache import ParseCache
 from .config import config
+from .quiz import PrefetchQuiz
+from .snapshot import Snapshot
+from .util import decode_cursor, encode_cursor
 
 
 class JupyterFlashcard:
@@ -13,6 +20,11 @@ class JupyterFlashcard:
         """Supported kwargs are the same as in config dict
         {
             'engine': 'postgresql://localhost/jupyter-flashcard',
+            'user': 'default',
+            'parse_cache_path': '~/.jupyter-flashcard/parse-cache.sqlite',
+            'parse_cache_size': 64 * 2 ** 20,
+            'sqlite_timeout': 30,
+            'busy_retries': 5,
             'host': 'localhost',
             'port': 7000,
             'debug': False,
@@ -29,15 +41,44 @@ class JupyterFlashcard:
                 9: timedelta(weeks=16)
             }
         }
+
+        'user' is the learner whose SRS state (db.Review) is read and updated,
+        so that many learners can share the same database, even from the same process.
+        It is bound to this instance (self.user and self.session.info['user']), rather than to the config.
+
+        'parse_cache_path' is where parsed notebooks are cached by checksum, so that unchanged notebooks
+        are not parsed again when rebuilding a database. It is created on the first parse. Set it to None to disable the cache.
+
+        'sqlite_timeout' is how long, in seconds, an SQLite connection waits for a lock held by another process,
+        and 'busy_retries' is how many times a write is retried after that.
         """
 
+        self.user = kwargs.pop('user', config['user'])
+
         config.update(kwargs)
 
-        self.engine = create_engine(config['engine'])
-        self.session = sessionmaker(bind=self.engine)()
+        if config['engine'].startswith('sqlite'):
+            # The session may be used by one thread at a time, e.g. self.update() by a background syncer
+            self.engine = create_engine(config['engine'], connect_args={'timeout': config['sqlite_timeout'],
+                                                                        'check_same_thread': False})
+            sa.event.listen(self.engine, 'connect', _set_sqlite_pragma)
+        else:
+            self.engine = create_engine(config['engine'])
+
+        self.session = sessionmaker(bind=self.engine, info={'user': self.user})()
 
         config['session'] = self.session
 
+        if migrate.upgrade(self.engine, create=False, user=self.user):
+            self._add_reviews()
+
+        if config['parse_cache_path']:
+            config['parse_cache'] = ParseCache(config['parse_cache_path'], config['parse_cache_size'])
+        else:
+            config['parse_cache'] = None
+
+        self.snapshot = None
+
     def __iter__(self):
         """Default iterator is the same as iterating through files
         
@@ -78,7 +119,8 @@ class JupyterFlashcard:
         return self.session.query(db.Cell)
 
     def init(self, initial_file_path=None):
-        """Initiate the JupyterFlashcard database for the first time
+        """Initiate the JupyterFlashcard database for the first time,
+        or upgrade an existing database to the latest schema (see migrate.py)
         
         Keyword Arguments:
             initial_file_path {str, pathlib.Path} -- 
@@ -87,34 +129,35 @@ class JupyterFlashcard:
                 (default: {None})
         """
 
-        db.Base.metadata.create_all(self.engine)
+        migrate.upgrade(self.engine, user=self.user)
+        self._add_reviews()
 
         if initial_file_path:
             self.add(initial_file_path)
 
+    def load_snapshot(self):
+        """Load an in-memory snapshot of flashcards, to be used by self.iter_quiz()
+
+        Returns:
+            Snapshot -- Kept up-to-date with changes made through self.session
+        """
+
+        if self.snapshot is None:
+            self.snapshot = Snapshot(self.session, self.user)
+
+        return self.snapshot.load()
+
     def search_files(self, filename=None, tags=None):
         """Searching through files in the database
         
         Keyword Arguments:
             filename {str} -- Substring of filenames (default: {None})
-            tags {iterable} -- Iterable of substrings of tags (default: {None})
+            tags {iterable} -- Iterable of tags, all of which must be present (default: {None})
         Yields:
             db.File SQLAlchemy object -- The object matching the criteria
         """
 
-        for db_file in self.files:
-            if filename:
-                if filename not in db_file.name:
-                    continue
-            if tags:
-                do_continue = False
-                for tag in tags:
-                    if tag not in db_file.tags:
-                        do_continue = True
-                        break
-                if do_continue:
-                    continue
-
+        for db_file in self._query_files(filename=filename, tags=tags):
             yield db_file
 
     def search_flashcards(self,
@@ -139,112 +182,231 @@ class JupyterFlashcard:
             db.Flashcard SQLAlchemy object -- The object matching the criteria
         """
 
-        def _has_content(_db_flashcard):
-            for _db_cell in _db_flashcard.cells:
-                if content in _db_cell.data:
-                    return True
+        for db_flashcard in self._query_flashcards(content=content,
+                                                   min_srs=min_srs, max_srs=max_srs,
+                                                   due=due,
+                                                   tags=tags,
+                                                   filename=filename):
+            yield db_flashcard
 
-            return False
+    def search_cells(self,
+                     content=None,
+                     filename=None,
+                     tags=None):
+        """Searching through cells in the database
+        
+        Keyword Arguments:
+            content {str} -- Substring matching db.Cell.data (default: {None})
+            filename {str} -- Substring of filename (default: {None})
+            tags {iterable} -- Iterable of substring of tags (default: {None})
+        
+        Yields:
+            db.Cell SQLAlchemy object -- The object matching the criteria
+        """
+
+        for db_cell in self._query_cells(content=content, filename=filename, tags=tags):
+            yield db_cell
+
+    def search_files_page(self, page_size=50, cursor=None, order_by='id', **kwargs):
+        """Same as self.search_files(), but one page at a time
+
+        Keyword Arguments:
+            page_size {int} -- Maximal number of files per page (default: {50})
+            cursor {str} -- Cursor returned with the previous page, or None for the first page (default: {None})
+            order_by {str} -- 'id' or 'modified' (default: {'id'})
+            Others are the same as self.search_files()
+
+        Returns:
+            tuple -- (list of db.File, cursor of the next page, or None for the last page)
+        """
+
+        return self._paginate(self._query_files(**kwargs), {
+            'id': db.File.id,
+            'modified': db.File.updated
+        }, db.File.id, page_size, cursor, order_by)
 
-        def _has_tag(_db_flashcard, _tag):
-            for t in _db_flashcard.tags:
-                if _tag in t:
-                    return True
+    def search_flashcards_page(self, page_size=50, cursor=None, order_by='id', with_content=False, **kwargs):
+        """Same as self.search_flashcards(), but one page at a time
+
+        Keyword Arguments:
+            page_size {int} -- Maximal number of flashcards per page (default: {50})
+            cursor {str} -- Cursor returned with the previous page, or None for the first page (default: {None})
+            order_by {str} -- 'id', 'modified' or 'next_review' (default: {'id'})
+            with_content {bool} -- Load the cells and their db.Cell.data of the whole page at once (default: {False})
+            Others are the same as self.search_flashcards()
+
+        Returns:
+            tuple -- (list of db.Flashcard, cursor of the next page, or None for the last page)
+        """
 
-            return False
+        query = self._query_flashcards(**kwargs)
+        if with_content:
+            query = query.options(selectinload(db.Flashcard.flashcard_cell_connects)
+                                  .selectinload(db.FlashcardCellConnect.cell)
+                                  .undefer('data'))
 
-        def _has_tags(_db_flashcard, _tags):
-            for _tag in _tags:
-                if _has_tag(_db_flashcard, _tag):
-                    return True
+        return self._paginate(query, {
+            'id': db.Flashcard.id,
+            'modified': db.Flashcard.modified,
+            'next_review': db.Review.next_review
+        }, db.Flashcard.id, page_size, cursor, order_by)
+
+    def search_cells_page(self, page_size=50, cursor=None, order_by='id', with_content=False, **kwargs):
+        """Same as self.search_cells(), but one page at a time
+
+        Keyword Arguments:
+            page_size {int} -- Maximal number of cells per page (default: {50})
+            cursor {str} -- Cursor returned with the previous page, or None for the first page (default: {None})
+            order_by {str} -- 'id' or 'modified' (default: {'id'})
+            with_content {bool} -- Load db.Cell.data of the whole page at once (default: {False})
+            Others are the same as self.search_cells()
+
+        Returns:
+            tuple -- (list of db.Cell, cursor of the next page, or None for the last page)
+        """
 
-            return False
+        query = self._query_cells(**kwargs)
+        if with_content:
+            query = query.options(undefer(db.Cell.data))
 
-        def _has_filename(_db_flashcard):
-            for _filename in _db_flashcard.filenames:
-                if filename in _filename:
-                    return True
+        return self._paginate(query, {
+            'id': db.Cell.id,
+            'modified': db.Cell.modified
+        }, db.Cell.id, page_size, cursor, order_by)
 
-            return False
+    def _query_files(self, filename=None, tags=None):
+        query = self.files
 
+        if filename:
+            query = query.filter(_contains(db.File.name, filename))
+
+        if tags:
+            for tag in tags:
+                query = query.filter(sa.or_(
+                    _has_tag(db.File.tags_str, tag),
+                    db.File.cells.any(_has_tag(db.Cell.tags_str, tag))
+                ))
+
+        return query
+
+    def _query_flashcards(self,
+                          content=None,
+                          min_srs=0, max_srs=None,
+                          due=None,
+                          tags=None,
+                          filename=None):
         if not max_srs:
             max_srs = len(config['srs']) + 1
 
-        for db_flashcard in self.flashcards:
-            if content:
-                if not _has_content(db_flashcard):
-                    continue
+        # Every flashcard has a review of self.user (see self._add_reviews()),
+        # so that due flashcards are a range of ix_review_user_id_next_review.
+        query = self.flashcards \
+            .join(db.Review, sa.and_(db.Review.flashcard_id == db.Flashcard.id,
+                                     db.Review.user_id == self.user)) \
+            .filter(db.Review.srs_level.between(min_srs, max_srs))
 
-            if db_flashcard.srs_level not in range(min_srs, max_srs + 1):
-                continue
+        if due:
+            if isinstance(due, timedelta):
+                due = datetime.now() + due
 
-            if due:
-                if isinstance(due, timedelta):
-                    due = datetime.now() + due
+            query = query.filter(db.Review.next_review <= due)
 
-                if db_flashcard.next_review > due:
-                    continue
+        if content:
+            query = query.filter(_has_cell(_contains(db.Cell.data, content)))
 
-            if tags:
-                if not _has_tags(db_flashcard, tags):
-                    continue
+        if tags:
+            query = query.filter(sa.or_(
+                _has_tag_substring(db.Flashcard.tags_str, tags),
+                _has_cell(sa.or_(
+                    _has_tag_substring(db.Cell.tags_str, tags),
+                    db.Cell.file_.has(_has_tag_substring(db.File.tags_str, tags))
+                ))
+            ))
 
-            if filename:
-                if not _has_filename(db_flashcard):
-                    continue
+        if filename:
+            query = query.filter(_has_cell(db.Cell.file_.has(_contains(db.File.name, filename))))
 
-            yield db_flashcard
+        return query
 
-    def search_cells(self,
+    def _query_cells(self,
                      content=None,
                      filename=None,
                      tags=None):
-        """Searching through cells in the database
-        
-        Keyword Arguments:
-            content {str} -- Substring matching db.Cell.data (default: {None})
-            filename {str} -- Substring of filename (default: {None})
-            tags {iterable} -- Iterable of substring of tags (default: {None})
-        
-        Yields:
-            db.Cell SQLAlchemy object -- The object matching the criteria
-        """
+        query = self.cells
 
+        if content:
+            query = query.filter(_contains(db.Cell.data, content))
 
-        def _has_tag(_db_cell, _tag):
-            for t in _db_cell.tags:
-                if _tag in t:
-                    return True
+        if filename:
+            query = query.filter(db.Cell.file_.has(_contains(db.File.name, filename)))
 
-            return False
+        if tags:
+            query = query.filter(sa.or_(
+                _has_tag_substring(db.Cell.tags_str, tags),
+                db.Cell.file_.has(_has_tag_substring(db.File.tags_str, tags))
+            ))
 
-        def _has_tags(_db_cell, _tags):
-            for _tag in _tags:
-                if _has_tag(_db_cell, _tag):
-                    return True
+        return query
 
-            return False
+    @db.retry_on_locked
+    def _add_reviews(self):
+        """Bind self.user to the database, by adding the reviews of flashcards that self.user has not seen yet"""
 
-        for db_cell in self.cells:
-            if content:
-                if content not in db_cell.data:
-                    continue
+        db.Review.add_missing(self.session, users=[self.user])
+        self.session.commit()
 
-            if filename:
-                if filename not in db_cell.filename:
-                    continue
+    def _is_memory_database(self):
+        # Each thread has its own in-memory SQLite database
+        return self.engine.dialect.name == 'sqlite' and self.engine.url.database in (None, '', ':memory:')
 
-            if tags:
-                if not _has_tags(db_cell, tags):
-                    continue
+    def _paginate(self, query, sort_keys, id_column, page_size, cursor, order_by):
+        if page_size < 1:
+            raise ValueError('page_size must be at least 1, not {!r}'.format(page_size))
 
-            yield db_cell
+        if order_by not in sort_keys.keys():
+            raise ValueError('Cannot order by {!r}, only by {}'.format(order_by, ', '.join(sort_keys.keys())))
+
+        sort_column = sort_keys[order_by]
+        if sort_column is not id_column and self.engine.dialect.name == 'sqlite':
+            # SQLite stores datetimes as text, both with and without microseconds (CURRENT_TIMESTAMP),
+            # so they are compared as stored.
+            sort_column = sa.type_coerce(sort_column, sa.String)
+
+        if cursor:
+            cursor_order_by, sort_value, last_id = decode_cursor(cursor)
+            if cursor_order_by != order_by:
+                raise ValueError('The cursor is for ordering by {!r}, not {!r}'.format(cursor_order_by, order_by))
+
+            if sort_column is id_column:
+                query = query.filter(id_column > last_id)
+            else:
+                query = query.filter(sa.or_(sort_column > sort_value,
+                                            sa.and_(sort_column == sort_value, id_column > last_id)))
+
+        if sort_column is id_column:
+            rows = query.add_columns(id_column).order_by(id_column)
+        else:
+            rows = query.add_columns(sort_column).order_by(sort_column, id_column)
 
-    def iter_quiz(self, tags=None):
+        rows = rows.limit(page_size + 1).all()
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last_item, last_sort_value = rows[-1]
+            next_cursor = encode_cursor(order_by, last_sort_value, last_item.id)
+
+        return [item for item, _ in rows], next_cursor
+
+    def iter_quiz(self, tags=None, prefetch=0):
         """Generate an iterator of db.Flashcard quiz
         
         Keyword Arguments:
             tags {iterable} -- Iterable of substring of tags (default: {None})
+            prefetch {int} -- 
+                Number of flashcards to load and render in advance on a background thread.
+                If 0, flashcards are loaded when shown.
+                (default: {0})
         
         Returns:
             iterator -- 
@@ -252,9 +414,24 @@ class JupyterFlashcard:
                 To use it, create a iterator, and then call next() repeatedly (see README.md)
         """
 
+        if self.snapshot is not None:
+            quiz_ids = [record.id for record in self.snapshot.filter(due=datetime.now(), tags=tags)]
+            random.shuffle(quiz_ids)
+
+            if prefetch and not self._is_memory_database():
+                return PrefetchQuiz(self.session, quiz_ids, prefetch)
+
+            # Cards deleted since self.snapshot.filter() are skipped
+            db_flashcards = (self.session.query(db.Flashcard).get(quiz_id) for quiz_id in quiz_ids)
+
+            return (db_flashcard for db_flashcard in db_flashcards if db_flashcard is not None)
+
         quiz_list = list(self.search_flashcards(due=datetime.now(), tags=tags))
         random.shuffle(quiz_list)
 
+        if prefetch and not self._is_memory_database():
+            return PrefetchQuiz(self.session, [db_flashcard.id for db_flashcard in quiz_list], prefetch)
+
         return iter(quiz_list)
 
     def quiz(self, *args, **kwargs):
@@ -266,15 +443,14 @@ class JupyterFlashcard:
 
         return next(self.iter_quiz(*args, **kwargs))
 
-    @classmethod
-    def add(cls, fp):
+    def add(self, fp):
         """Add a Jupyter Notebook file to the database
         
         Arguments:
             fp {str|Path} -- A Jupyter Notebook file or a folder containing Jupyter Notebook files.
         """
 
-        db.File.add(fp)
+        db.File.add(fp, session=self.session)
 
     def update(self, *args, **kwargs):
         """Update all files in the database
@@ -290,3 +466,48 @@ class JupyterFlashcard:
 
         for db_file in files:
             db_file.update()
+
+
+def _has_cell(criterion):
+    return db.Flashcard.flashcard_cell_connects.any(db.FlashcardCellConnect.cell.has(criterion))
+
+
+def _has_tag(tags_str_column, tag):
+    return _contains(sa.literal('\n') + tags_str_column + '\n', '\n' + tag + '\n')
+
+
+def _has_tag_substring(tags_str_column, tags):
+    return sa.or_(*[_contains(tags_str_column, tag) for tag in tags])
+
+
+def _contains(column, substring):
+    """Case-sensitive substring match, like Python's `in`, unlike LIKE of SQLite"""
+
+    return _strpos(column, substring) > 0
+
+
+class _strpos(FunctionElement):
+    type = sa.Integer()
+    name = 'strpos'
+
+
+@compiles(_strpos)
+def _compile_strpos(element, compiler, **kw):
+    return 'instr({})'.format(compiler.process(element.clauses, **kw))
+
+
+@compiles(_strpos, 'postgresql')
+def _compile_strpos_postgresql(element, compiler, **kw):
+    return 'strpos({})'.format(compiler.process(element.clauses, **kw))
+
+
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """WAL lets readers work while another process writes"""
+
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA cache_size=-16000')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA busy_timeout={:d}'.format(int(config['sqlite_timeout'] * 1000)))
+    cursor.close()
@@ -0,0 +1,126 @@
+import logging
+
+import sqlalchemy as sa
+
+from . import db
+from .config import config
+
+
+def _initial(conn, user):
+    """Schema of version 0.1.2, which had no schema_version table"""
+
+    pass
+
+
+def _add_review(conn, user):
+    """Move SRS state from flashcard into the per-learner review table, as the progress of user"""
+
+    db.Review.__table__.create(conn, checkfirst=True)
+
+    flashcard_columns = {column['name'] for column in sa.inspect(conn).get_columns('flashcard')}
+    if {'srs_level', 'next_review'} <= flashcard_columns:
+        flashcard = sa.table('flashcard', sa.column('id'), sa.column('srs_level'), sa.column('next_review'))
+        review = db.Review.__table__
+
+        conn.execute(review.insert().from_select(
+            ['user_id', 'flashcard_id', 'srs_level', 'next_review'],
+            sa.select([sa.literal(user),
+                       flashcard.c.id,
+                       sa.func.coalesce(flashcard.c.srs_level, 0),
+                       sa.func.coalesce(flashcard.c.next_review, sa.func.now())])
+            .where(sa.not_(sa.exists().where(sa.and_(review.c.user_id == user,
+                                                    review.c.flashcard_id == flashcard.c.id))))
+        ))
+
+
+def _add_indexes(conn, user):
+    """Add indexes on foreign keys, file names and due dates"""
+
+    for table in db.Base.metadata.sorted_tables:
+        existing = {index['name'] for index in sa.inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+
+
+MIGRATIONS = [
+    (1, _initial),
+    (2, _add_review),
+    (3, _add_indexes)
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """Get the schema version of the database
+
+    Arguments:
+        conn {sqlalchemy.engine.Connection} -- Connection to the database
+
+    Returns:
+        int -- 0, if the database is empty
+    """
+
+    table_names = sa.inspect(conn).get_table_names()
+
+    if db.SchemaVersion.__tablename__ in table_names:
+        version = conn.execute(sa.select([sa.func.max(db.SchemaVersion.version)])).scalar()
+        if version is not None:
+            return version
+
+    if db.Flashcard.__tablename__ in table_names:
+        return 1
+
+    return 0
+
+
+def upgrade(engine, create=True, user=None):
+    """Upgrade the database in place to the latest schema
+
+    Arguments:
+        engine {sqlalchemy.engine.Engine} -- Engine of the database
+
+    Keyword Arguments:
+        create {bool} -- Create the tables, if the database is empty (default: {True})
+        user {str} -- The learner, who inherits the SRS state of a single-learner database (default: {config['user']})
+
+    Returns:
+        int -- The schema version after upgrade
+    """
+
+    if user is None:
+        user = config['user']
+
+    with engine.begin() as conn:
+        version = get_version(conn)
+
+        if version == 0:
+            if not create:
+                return version
+
+            db.Base.metadata.create_all(conn)
+            _set_version(conn, LATEST_VERSION)
+
+            return LATEST_VERSION
+
+        if version > LATEST_VERSION:
+            raise ValueError('Database schema version {} is newer than {} of this package'
+                             .format(version, LATEST_VERSION))
+
+        for migration_version, migration in MIGRATIONS:
+            if migration_version > version:
+                logging.info('Upgrading database schema to version %d: %s',
+                             migration_version, migration.__doc__)
+                migration(conn, user)
+                _set_version(conn, migration_version)
+
+        if version < LATEST_VERSION:
+            db.Base.metadata.create_all(conn)
+
+        return LATEST_VERSION
+
+
+def _set_version(conn, version):
+    db.SchemaVersion.__table__.create(conn, checkfirst=True)
+    conn.execute(db.SchemaVersion.__table__.insert().values(version=version))
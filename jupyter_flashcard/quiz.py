@@ -0,0 +1,126 @@
+import logging
+import queue
+import threading
+
+from sqlalchemy.orm import selectinload, sessionmaker
+
+from . import db
+from .enum import FlashcardCellType
+
+_DONE = object()
+
+
+class PrefetchQuiz:
+    """Iterator of db.Flashcard, which loads and renders the next cards on a background thread,
+    while the current card is shown.
+    """
+
+    def __init__(self, session, quiz_ids, prefetch=3):
+        """
+        Arguments:
+            session {sqlalchemy.orm.Session} -- Session of the flashcards to return.
+                The background thread uses its own session of the same engine.
+            quiz_ids {list} -- db.Flashcard.id's, in the order to quiz
+
+        Keyword Arguments:
+            prefetch {int} -- Number of cards to prepare in advance (default: {3})
+        """
+
+        self.session = session
+
+        self._queue = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=_prefetch,
+                                        args=(session.bind, list(quiz_ids), self._queue, self._stop),
+                                        daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._stop.is_set():
+            raise StopIteration
+
+        item = self._queue.get()
+        if item is _DONE:
+            self._stop.set()
+            raise StopIteration
+        elif isinstance(item, Exception):
+            self.close()
+            raise item
+
+        quiz_id, rendered = item
+
+        db_flashcard = self.session.query(db.Flashcard).get(quiz_id)
+        if db_flashcard is None:
+            return next(self)
+
+        db_flashcard.rendered = rendered
+
+        return db_flashcard
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        # Do not wait for the thread here; it stops within 0.1 s
+        self._stop.set()
+
+    def close(self):
+        """Stop the background thread, and discard the cards prepared in advance"""
+
+        self._stop.set()
+
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+
+def _prefetch(engine, quiz_ids, queue_, stop):
+    """Runs on the background thread, without any reference to PrefetchQuiz, so that it can be garbage collected"""
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                queue_.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    session = sessionmaker(bind=engine)()
+
+    try:
+        for quiz_id in quiz_ids:
+            if stop.is_set():
+                return
+
+            db_flashcard = session.query(db.Flashcard) \
+                .options(selectinload(db.Flashcard.flashcard_cell_connects)
+                         .joinedload(db.FlashcardCellConnect.cell)
+                         .undefer('data')) \
+                .get(quiz_id)
+            if db_flashcard is None:
+                continue
+
+            _put((quiz_id, {
+                FlashcardCellType.FRONT: [_render(db_cell) for db_cell in db_flashcard.fronts],
+                FlashcardCellType.BACK: [_render(db_cell) for db_cell in db_flashcard.backs]
+            }))
+
+            session.expunge_all()
+    except Exception as e:
+        logging.exception('Cannot prefetch flashcards')
+        _put(e)
+    finally:
+        session.close()
+        _put(_DONE)
+
+
+def _render(db_cell):
+    return {'text/markdown': db_cell.data}
@@ -0,0 +1,303 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import random
+import sys
+
+import sqlalchemy as sa
+
+from . import db
+from .config import config
+from .enum import FlashcardCellType
+
+
+class CellRecord:
+    __slots__ = ('id', 'file_id', 'filename', 'tags')
+
+    def __init__(self, id_, file_id, filename, tags):
+        self.id = id_
+        self.file_id = file_id
+        self.filename = filename
+        self.tags = tags
+
+    def __repr__(self):
+        return 'CellRecord(id={!r}, filename={!r})'.format(self.id, self.filename)
+
+
+class CardRecord:
+    __slots__ = ('id', 'srs_level', 'next_review', 'tags', 'filenames',
+                 'front_ids', 'back_ids', 'extra_ids')
+
+    def __init__(self, id_, srs_level, next_review, tags, filenames, front_ids, back_ids, extra_ids):
+        self.id = id_
+        self.srs_level = srs_level
+        self.next_review = next_review
+        self.tags = tags
+        self.filenames = filenames
+        self.front_ids = front_ids
+        self.back_ids = back_ids
+        self.extra_ids = extra_ids
+
+    @property
+    def cell_ids(self):
+        return self.front_ids + self.back_ids + self.extra_ids
+
+    def __repr__(self):
+        return 'CardRecord(id={!r}, srs_level={!r}, next_review={!r})'.format(
+            self.id, self.srs_level, self.next_review)
+
+
+class Snapshot:
+    """Read-only, in-memory model of the flashcards, for fast filtering during quizzes.
+
+    Cards and cells are kept as __slots__ records, with interned tags
+    and precomputed front/back cell ids, all loaded in one bulk query.
+    Cell contents are not loaded; use the database for content search.
+
+    Rows flushed through the bound session (File.update, reviews, tagging) are marked stale,
+    and are reloaded on the next read.
+    """
+
+    def __init__(self, session, user=None):
+        """
+        Arguments:
+            session {sqlalchemy.orm.Session} -- Session to load from, and to listen to for changes
+
+        Keyword Arguments:
+            user {str} -- The learner, whose SRS state is loaded (default: {config['user']})
+        """
+
+        self.session = session
+        self.user = user if user is not None else config['user']
+
+        self.cards = dict()
+        self.cells = dict()
+
+        self._cell_cards = defaultdict(set)
+        self._file_cells = defaultdict(set)
+        self._tag_sets = dict()
+
+        self._stale = set()
+        self._loaded = False
+
+        sa.event.listen(self.session, 'after_flush', self._on_flush)
+
+    def close(self):
+        """Stop listening to the session, and drop all records"""
+
+        if sa.event.contains(self.session, 'after_flush', self._on_flush):
+            sa.event.remove(self.session, 'after_flush', self._on_flush)
+
+        self.cards.clear()
+        self.cells.clear()
+        self._cell_cards.clear()
+        self._file_cells.clear()
+        self._tag_sets.clear()
+        self._stale.clear()
+        self._loaded = False
+
+    def load(self):
+        """(Re)load the whole collection in one query
+
+        Returns:
+            Snapshot -- self
+        """
+
+        self.close()
+        sa.event.listen(self.session, 'after_flush', self._on_flush)
+
+        self._add_rows(self._query())
+        self._loaded = True
+
+        return self
+
+    def refresh(self):
+        """Reload the records of stale flashcards only"""
+
+        if not self._loaded:
+            self.load()
+            return
+
+        if not self._stale:
+            return
+
+        card_ids = list(self._stale)
+        self._stale.clear()
+
+        for card_id in card_ids:
+            self.cards.pop(card_id, None)
+
+        for i in range(0, len(card_ids), 500):
+            self._add_rows(self._query(card_ids[i:i + 500]))
+
+    def get(self, card_id):
+        """Get a flashcard record
+
+        Arguments:
+            card_id {int} -- db.Flashcard.id
+
+        Returns:
+            CardRecord -- None, if not found
+        """
+
+        self.refresh()
+
+        return self.cards.get(card_id)
+
+    def filter(self, min_srs=0, max_srs=None, due=None, tags=None, filename=None):
+        """Same as JupyterFlashcard.search_flashcards(), except for content, but in memory
+
+        Keyword Arguments:
+            min_srs {int} -- Minimal db.Flashcard.srs_level (default: {0})
+            max_srs {int} -- Maximal db.Flashcard.srs_level (default: {None})
+            due {datetime.datetime, datetime.timedelta} -- Minimal due datetime, or timedelta distance from now (default: {None})
+            tags {iterable} -- Iterable of substrings of tags (default: {None})
+            filename {str} -- Substring of filename (default: {None})
+
+        Returns:
+            list -- List of CardRecord's
+        """
+
+        self.refresh()
+
+        if not max_srs:
+            max_srs = len(config['srs']) + 1
+
+        if due and isinstance(due, timedelta):
+            due = datetime.now() + due
+
+        result = list()
+        for record in self.cards.values():
+            if record.srs_level is None or not min_srs <= record.srs_level <= max_srs:
+                continue
+
+            if due and record.next_review > due:
+                continue
+
+            if tags and not any(tag in t for tag in tags for t in record.tags):
+                continue
+
+            if filename and not any(filename in fn for fn in record.filenames):
+                continue
+
+            result.append(record)
+
+        return result
+
+    def pick(self, **kwargs):
+        """Pick a random due flashcard record
+
+        Arguments:
+            Same as self.filter(), but due defaults to now
+
+        Returns:
+            CardRecord -- None, if nothing is due
+        """
+
+        kwargs.setdefault('due', datetime.now())
+        records = self.filter(**kwargs)
+
+        if records:
+            return random.choice(records)
+
+        return None
+
+    def _query(self, card_ids=None):
+        query = self.session.query(db.Flashcard.id,
+                                   db.Review.srs_level,
+                                   db.Review.next_review,
+                                   db.Flashcard.tags_str,
+                                   db.FlashcardCellConnect.type_,
+                                   db.Cell.id, db.Cell.tags_str,
+                                   db.File.id, db.File.name, db.File.tags_str) \
+            .join(db.Review, sa.and_(db.Review.flashcard_id == db.Flashcard.id,
+                                     db.Review.user_id == self.user)) \
+            .outerjoin(db.FlashcardCellConnect, db.FlashcardCellConnect.flashcard_id == db.Flashcard.id) \
+            .outerjoin(db.Cell, db.Cell.id == db.FlashcardCellConnect.cell_id) \
+            .outerjoin(db.File, db.File.id == db.Cell.file_id)
+
+        if card_ids is not None:
+            query = query.filter(db.Flashcard.id.in_(card_ids))
+
+        return query.order_by(db.Flashcard.id, db.FlashcardCellConnect.id)
+
+    def _add_rows(self, rows):
+        card = None
+        for (card_id, srs_level, next_review, card_tags_str,
+             type_, cell_id, cell_tags_str,
+             file_id, file_name, file_tags_str) in rows:
+            if card is None or card['id'] != card_id:
+                self._add_card(card)
+                card = {
+                    'id': card_id,
+                    'srs_level': srs_level,
+                    'next_review': next_review,
+                    'tags': set(self._split_tags(card_tags_str)),
+                    'filenames': set(),
+                    FlashcardCellType.FRONT: list(),
+                    FlashcardCellType.BACK: list(),
+                    FlashcardCellType.EXTRA: list()
+                }
+
+            if cell_id is None:
+                continue
+
+            cell = self.cells.get(cell_id)
+            if cell is None:
+                filename = sys.intern(file_name) if file_name else None
+                cell_tags = self._tag_set(set(self._split_tags(cell_tags_str))
+                                          | set(self._split_tags(file_tags_str)))
+                cell = self.cells[cell_id] = CellRecord(cell_id, file_id, filename, cell_tags)
+                self._file_cells[file_id].add(cell_id)
+
+            self._cell_cards[cell_id].add(card_id)
+
+            card[type_].append(cell_id)
+            card['tags'].update(cell.tags)
+            if cell.filename:
+                card['filenames'].add(cell.filename)
+
+        self._add_card(card)
+
+    def _add_card(self, card):
+        if card is None:
+            return
+
+        self.cards[card['id']] = CardRecord(card['id'], card['srs_level'], card['next_review'],
+                                            self._tag_set(card['tags']),
+                                            tuple(card['filenames']),
+                                            tuple(card[FlashcardCellType.FRONT]),
+                                            tuple(card[FlashcardCellType.BACK]),
+                                            tuple(card[FlashcardCellType.EXTRA]))
+
+    def _tag_set(self, tags):
+        tags = frozenset(sys.intern(tag) for tag in tags)
+
+        return self._tag_sets.setdefault(tags, tags)
+
+    @staticmethod
+    def _split_tags(tags_str):
+        if tags_str:
+            return tags_str.strip().split('\n')
+
+        return []
+
+    def _on_flush(self, session, flush_context):
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, db.Flashcard):
+                self._stale.add(obj.id)
+            elif isinstance(obj, db.Review):
+                if obj.user_id == self.user:
+                    self._stale.add(obj.flashcard_id)
+            elif isinstance(obj, db.FlashcardCellConnect):
+                self._stale.add(obj.flashcard_id)
+            elif isinstance(obj, db.Cell):
+                self._invalidate_cell(obj.id)
+            elif isinstance(obj, db.File):
+                for cell_id in self._file_cells.pop(obj.id, set()):
+                    self._invalidate_cell(cell_id)
+
+        self._stale.discard(None)
+
+    def _invalidate_cell(self, cell_id):
+        self.cells.pop(cell_id, None)
+        self._stale.update(self._cell_cards.pop(cell_id, set()))
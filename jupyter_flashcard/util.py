@@ -1,10 +1,16 @@
 from pathlib import Path
 import json
 from collections import OrderedDict
+from datetime import datetime
+import base64
+import hashlib
 import html
 
 from .enum import CellType
 
+# Bump whenever the output of parse_jupyter() changes, so that cached cells are parsed again
+PARSER_VERSION = 1
+
 
 def complete_path_split(path, relative_to=None):
     components = []
@@ -30,20 +36,61 @@ def get_files(suffixes, src):
             yield fp
 
 
+def get_checksum(data, algorithm='blake2b'):
+    if algorithm == 'md5':
+        return hashlib.md5(data).hexdigest()
+
+    return '{}:{}'.format(algorithm, hashlib.new(algorithm, data).hexdigest())
+
+
+def is_checksum(checksum, data):
+    if ':' in checksum:
+        algorithm = checksum.split(':', 1)[0]
+    else:
+        algorithm = 'md5'
+
+    return checksum == get_checksum(data, algorithm)
+
+
 def read_jupyter(fp):
-    with Path(fp).open() as f:
-        for cell in json.load(f, object_pairs_hook=OrderedDict).get('cells', []):
-            if cell['cell_type'] == 'code':
-                for output in cell.get('outputs', []):
-                    if output['output_type'] == 'display_data':
-                        data = output['data']
-                        types = data.keys()
-                        if CellType.HTML in types:
-                            yield ''.join(data[CellType.HTML])
-                        elif CellType.PLAIN in types:
-                            yield '<pre></pre>'.format(html.escape(''.join(data[CellType.PLAIN])))
-                        else:
-                            raise TypeError(repr(types))
-
-            elif cell['cell_type'] == CellType.MARKDOWN:
-                yield ''.join(cell['source'])
+    return parse_jupyter(Path(fp).read_bytes())
+
+
+def parse_jupyter(raw):
+    for cell in json.loads(raw.decode('utf-8'), object_pairs_hook=OrderedDict).get('cells', []):
+        if cell['cell_type'] == 'code':
+            for output in cell.get('outputs', []):
+                if output['output_type'] == 'display_data':
+                    data = output['data']
+                    types = data.keys()
+                    if CellType.HTML in types:
+                        yield ''.join(data[CellType.HTML])
+                    elif CellType.PLAIN in types:
+                        yield '<pre></pre>'.format(html.escape(''.join(data[CellType.PLAIN])))
+                    else:
+                        raise TypeError(repr(types))
+
+        elif cell['cell_type'] == CellType.MARKDOWN:
+            yield ''.join(cell['source'])
+
+
+def encode_cursor(order_by, sort_value, id_):
+    if isinstance(sort_value, datetime):
+        sort_value = {'datetime': sort_value.strftime('%Y-%m-%dT%H:%M:%S.%f')}
+
+    return base64.urlsafe_b64encode(json.dumps([order_by, sort_value, id_]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        order_by, sort_value, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor: {!r}'.format(cursor))
+
+    if isinstance(sort_value, dict):
+        try:
+            sort_value = datetime.strptime(sort_value['datetime'], '%Y-%m-%dT%H:%M:%S.%f')
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Invalid cursor: {!r}'.format(cursor))
+
+    return order_by, sort_value, id_
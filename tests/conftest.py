@@ -0,0 +1,38 @@
+from copy import copy
+import json
+
+import pytest
+
+from jupyter_flashcard.config import config
+
+
+@pytest.fixture(autouse=True)
+def restore_config():
+    saved = copy(config)
+    yield
+    config.clear()
+    config.update(saved)
+
+
+@pytest.fixture
+def notebook_dir(tmp_path):
+    """A folder of 3 notebooks, of 5 flashcards each"""
+
+    folder = tmp_path / 'notebooks' / 'deck'
+    folder.mkdir(parents=True)
+
+    for i in range(3):
+        write_notebook(folder / 'n{}.ipynb'.format(i),
+                       [cell for j in range(5) for cell in ('# Q {}-{}'.format(i, j), 'A {}-{}'.format(i, j))]
+                       + ['# end {}'.format(i)])
+
+    return folder.parent
+
+
+def write_notebook(path, cells):
+    path.write_text(json.dumps({
+        'cells': [{'cell_type': 'markdown', 'metadata': {}, 'source': [cell]} for cell in cells],
+        'metadata': {},
+        'nbformat': 4,
+        'nbformat_minor': 2
+    }))
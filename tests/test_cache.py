@@ -0,0 +1,114 @@
+import itertools
+import json
+import threading
+import zlib
+
+import pytest
+
+from jupyter_flashcard import JupyterFlashcard, cache, db
+from jupyter_flashcard.cache import ParseCache
+
+from conftest import write_notebook
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return tmp_path / 'cache' / 'parse-cache.sqlite'
+
+
+@pytest.fixture
+def parse_calls(monkeypatch):
+    calls = []
+    parse_jupyter = db.parse_jupyter
+
+    def _parse_jupyter(raw):
+        calls.append(raw)
+        return parse_jupyter(raw)
+
+    monkeypatch.setattr(db, 'parse_jupyter', _parse_jupyter)
+
+    return calls
+
+
+def _cell_data(jfc):
+    return sorted(db_cell.data for db_cell in jfc.cells)
+
+
+def test_hit_skips_parsing(tmp_path, notebook_dir, cache_path, parse_calls):
+    first = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'first.db'), parse_cache_path=cache_path)
+    first.init(notebook_dir)
+    assert len(parse_calls) == 3
+
+    second = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'second.db'), parse_cache_path=cache_path)
+    second.init(notebook_dir)
+    assert len(parse_calls) == 3
+
+    assert _cell_data(second) == _cell_data(first)
+
+
+def test_miss_after_parser_version_changes(tmp_path, notebook_dir, cache_path, parse_calls, monkeypatch):
+    JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'first.db'), parse_cache_path=cache_path) \
+        .init(notebook_dir)
+    assert len(parse_calls) == 3
+
+    monkeypatch.setattr(db, 'PARSER_VERSION', db.PARSER_VERSION + 1)
+
+    JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'second.db'), parse_cache_path=cache_path) \
+        .init(notebook_dir)
+    assert len(parse_calls) == 6
+
+
+def test_lru_eviction(cache_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(cache.time, 'time', lambda: next(clock))
+
+    cells = ['cell {}'.format(i) for i in range(100)]
+    entry_size = len(zlib.compress(json.dumps(cells).encode('utf-8')))
+
+    parse_cache = ParseCache(cache_path, max_size=3 * entry_size)
+    for key in 'abc':
+        parse_cache.put(key, cells)
+
+    assert parse_cache.get('a') == cells
+    parse_cache.put('d', cells)
+
+    assert parse_cache.get('b') is None
+    assert all(parse_cache.get(key) == cells for key in 'acd')
+
+
+def test_entry_larger_than_max_size_is_not_cached(cache_path):
+    parse_cache = ParseCache(cache_path, max_size=10)
+    parse_cache.put('a', ['cell'] * 100)
+
+    assert parse_cache.get('a') is None
+
+
+def test_directory_is_created_on_first_use(tmp_path, notebook_dir, cache_path):
+    jfc = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'test.db'), parse_cache_path=cache_path)
+    assert not cache_path.parent.exists()
+
+    jfc.init(notebook_dir)
+    assert cache_path.exists()
+
+
+def test_update_from_another_thread(tmp_path, notebook_dir, cache_path):
+    jfc = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'test.db'), parse_cache_path=cache_path)
+    jfc.init(notebook_dir)
+
+    for db_file in jfc.files:
+        write_notebook(db_file.path, [db_cell.data for db_cell in db_file.cells] + ['# Q new ' + db_file.path.stem])
+
+    errors = []
+
+    def _update():
+        try:
+            jfc.update()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=_update)
+    thread.start()
+    thread.join()
+
+    assert errors == []
+    assert len(list(jfc.search_cells(content='# Q new'))) == 3
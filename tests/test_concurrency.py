@@ -0,0 +1,105 @@
+import multiprocessing
+import random
+import sqlite3
+import time
+
+import sqlalchemy as sa
+
+from jupyter_flashcard import JupyterFlashcard
+
+from conftest import write_notebook
+
+
+def _lock_once(monkeypatch, session):
+    commit = session.commit
+    calls = []
+
+    def _commit():
+        calls.append(None)
+        if len(calls) == 1:
+            raise sa.exc.OperationalError('COMMIT', {}, sqlite3.OperationalError('database is locked'))
+
+        commit()
+
+    monkeypatch.setattr(session, 'commit', _commit)
+
+    return calls
+
+
+def test_retry_reruns_the_whole_review(tmp_path, notebook_dir, monkeypatch):
+    jfc = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'test.db'), parse_cache_path=None)
+    jfc.init(notebook_dir)
+
+    db_flashcard = jfc.flashcards.first()
+    db_flashcard.right()
+    db_flashcard.right()
+    assert db_flashcard.srs_level == 2
+
+    calls = _lock_once(monkeypatch, jfc.session)
+    db_flashcard.wrong()
+
+    assert len(calls) == 2
+    assert db_flashcard.srs_level == 1
+
+
+def test_retry_reruns_all_tags(tmp_path, notebook_dir, monkeypatch):
+    jfc = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'test.db'), parse_cache_path=None)
+    jfc.init(notebook_dir)
+
+    db_flashcard = jfc.flashcards.first()
+
+    _lock_once(monkeypatch, jfc.session)
+    db_flashcard.add_tags(['a', 'b'])
+
+    assert sorted(db_flashcard.my_tags) == ['a', 'b']
+
+
+def _sync(url, notebook_dir, errors):
+    try:
+        jfc = JupyterFlashcard(engine=url, parse_cache_path=None)
+        for i in range(3):
+            for path in sorted(notebook_dir.glob('**/*.ipynb')):
+                cells = [db_cell.data for db_cell in jfc.search_cells(filename=str(path))]
+                write_notebook(path, cells + ['# sync {} {}'.format(i, path.stem), 'A {}'.format(i)])
+
+            jfc.update()
+    except Exception as e:
+        errors.put('sync: {!r}'.format(e))
+
+
+def _review(url, user, errors):
+    try:
+        jfc = JupyterFlashcard(engine=url, user=user, parse_cache_path=None)
+        deadline = time.time() + 3
+        while time.time() < deadline:
+            for db_flashcard in jfc.iter_quiz():
+                random.choice([db_flashcard.right, db_flashcard.wrong, db_flashcard.mark])()
+                list(jfc.search_flashcards(tags=['deck']))
+    except Exception as e:
+        errors.put('{}: {!r}'.format(user, e))
+
+
+def test_stress_sqlite_one_writer_many_reviewers(tmp_path, notebook_dir):
+    url = 'sqlite:///{}'.format(tmp_path / 'test.db')
+    jfc = JupyterFlashcard(engine=url, parse_cache_path=None)
+    jfc.init(notebook_dir)
+    assert jfc.engine.execute('PRAGMA journal_mode').scalar() == 'wal'
+    jfc.engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    errors = context.Queue()
+    processes = [context.Process(target=_sync, args=(url, notebook_dir, errors))]
+    processes += [context.Process(target=_review, args=(url, 'user{}'.format(i), errors)) for i in range(4)]
+
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+
+    messages = []
+    while not errors.empty():
+        messages.append(errors.get())
+
+    assert messages == []
+    assert [process.exitcode for process in processes] == [0] * len(processes)
+    assert len(list(jfc.search_cells(content='# sync 2'))) == 3
@@ -0,0 +1,155 @@
+from datetime import datetime
+
+import pytest
+
+from jupyter_flashcard import JupyterFlashcard, db
+from jupyter_flashcard.util import get_checksum, is_checksum
+
+from conftest import write_notebook
+
+
+@pytest.fixture
+def url(tmp_path, notebook_dir):
+    url = 'sqlite:///{}'.format(tmp_path / 'test.db')
+    JupyterFlashcard(engine=url, parse_cache_path=None).init(notebook_dir)
+
+    return url
+
+
+@pytest.fixture
+def alice_bob(url):
+    alice = JupyterFlashcard(engine=url, user='alice', parse_cache_path=None)
+    bob = JupyterFlashcard(engine=url, user='bob', parse_cache_path=None)
+
+    return alice, bob
+
+
+def test_tags_commit_the_session_of_the_instance(alice_bob):
+    alice, bob = alice_bob
+
+    db_flashcard = alice.flashcards.first()
+    db_flashcard.mark()
+    db_flashcard.fronts[0].mark('cell')
+    db_flashcard.fronts[0].file_.mark('file')
+    assert not alice.session.dirty
+
+    bob.session.expire_all()
+    db_flashcard = bob.flashcards.get(db_flashcard.id)
+    assert db_flashcard.my_tags == ['marked']
+    assert db_flashcard.fronts[0].my_tags == ['cell']
+    assert 'file' in db_flashcard.fronts[0].file_.my_tags
+
+
+def test_update_commits_the_session_of_the_instance(alice_bob):
+    alice, bob = alice_bob
+
+    db_file = alice.files.first()
+    write_notebook(db_file.path, [db_cell.data for db_cell in db_file.cells] + ['# new', 'A new'])
+    db_file.update()
+    assert not alice.session.dirty and not alice.session.new
+
+    bob.session.expire_all()
+    assert bob.files.get(db_file.id).checksum == db_file.checksum
+    assert bob.search_cells(content='A new')
+
+
+def test_add_uses_the_session_of_the_instance(alice_bob, tmp_path):
+    alice, bob = alice_bob
+
+    path = tmp_path / 'new.ipynb'
+    write_notebook(path, ['# Q new', 'A new', '# end new'])
+    alice.add(path)
+    assert not alice.session.new
+
+    assert list(alice.search_files(filename='new.ipynb'))
+    assert list(bob.search_files(filename='new.ipynb'))
+
+
+def test_every_learner_has_a_review_of_every_card(alice_bob, tmp_path):
+    alice, bob = alice_bob
+
+    path = tmp_path / 'new.ipynb'
+    write_notebook(path, ['# Q new', 'A new', '# end new'])
+    alice.add(path)
+
+    card_ids = {db_flashcard.id for db_flashcard in alice.flashcards}
+    for jfc in alice_bob:
+        assert {db_review.flashcard_id for db_review in jfc.session.query(db.Review).filter_by(user_id=jfc.user)} \
+            == card_ids
+        assert {db_flashcard.id for db_flashcard in jfc.search_flashcards(due=datetime.now())} == card_ids
+
+
+def test_deleted_card_deletes_its_reviews(alice_bob):
+    alice, bob = alice_bob
+
+    db_flashcard = alice.flashcards.first()
+    for db_fcc in db_flashcard.flashcard_cell_connects:
+        alice.session.delete(db_fcc)
+    alice.session.delete(db_flashcard)
+    alice.session.commit()
+
+    assert alice.session.query(db.Review).filter_by(flashcard_id=db_flashcard.id).count() == 0
+
+
+def test_update_stores_blake2b_checksum(url):
+    jfc = JupyterFlashcard(engine=url, parse_cache_path=None)
+
+    for db_file in jfc.files:
+        assert db_file.checksum.startswith('blake2b:')
+        assert is_checksum(db_file.checksum, db_file.path.read_bytes())
+        assert db_file.is_updated()
+
+
+def test_legacy_md5_checksum_is_not_updated(url, monkeypatch):
+    jfc = JupyterFlashcard(engine=url, parse_cache_path=None)
+
+    db_file = jfc.files.first()
+    db_file.checksum = get_checksum(db_file.path.read_bytes(), 'md5')
+    jfc.session.commit()
+
+    def _import_cells(*args):
+        raise AssertionError('Unchanged notebook is imported again')
+
+    monkeypatch.setattr(db.File, '_import_cells', _import_cells)
+
+    assert db_file.is_updated()
+    db_file.update()
+
+
+def test_duplicate_keeps_the_checksum(url):
+    jfc = JupyterFlashcard(engine=url, parse_cache_path=None)
+
+    db_file, other_file = jfc.files.limit(2).all()
+    checksum = db_file.checksum
+
+    write_notebook(db_file.path, [db_cell.data for db_cell in db_file.cells]
+                   + ['# Q before duplicate', other_file.cells[1].data, '# Q after duplicate'])
+    db_file.update()
+
+    jfc.session.expire_all()
+    assert db_file.checksum == checksum
+    assert db_file.is_updated() is False
+    assert not list(jfc.search_cells(content='after duplicate'))
+
+
+def test_failed_import_keeps_the_checksum(url, monkeypatch):
+    jfc = JupyterFlashcard(engine=url, parse_cache_path=None)
+
+    db_file = jfc.files.first()
+    checksum = db_file.checksum
+    cell_count = jfc.cells.count()
+
+    write_notebook(db_file.path, [db_cell.data for db_cell in db_file.cells] + ['# Q new', 'A new'])
+
+    def _parse(raw, checksum):
+        yield '# Q new'
+        raise ValueError('Cannot parse')
+
+    monkeypatch.setattr(db.File, '_parse', staticmethod(_parse))
+
+    with pytest.raises(ValueError):
+        db_file.update()
+
+    jfc.session.expire_all()
+    assert db_file.checksum == checksum
+    assert jfc.cells.count() == cell_count
@@ -0,0 +1,103 @@
+import tracemalloc
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import undefer
+
+from jupyter_flashcard import JupyterFlashcard, db
+
+from conftest import write_notebook
+
+
+@pytest.fixture
+def large_jfc(tmp_path):
+    """A collection of 200 flashcards, with 20 kB of content each"""
+
+    folder = tmp_path / 'notebooks'
+    folder.mkdir()
+    for i in range(10):
+        write_notebook(folder / 'n{}.ipynb'.format(i),
+                       [cell for j in range(20) for cell in ('# Q {}-{}'.format(i, j),
+                                                             'A {}-{} '.format(i, j) + 'x' * 20000)]
+                       + ['# end {}'.format(i)])
+
+    jfc = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'test.db'), parse_cache_path=None)
+    jfc.init(folder)
+    jfc.session.close()
+
+    return jfc
+
+
+def _is_deferred(db_cell):
+    return 'data' in sa.inspect(db_cell).unloaded
+
+
+def _traced_memory(load):
+    tracemalloc.start()
+    try:
+        result = load()
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+
+def test_metadata_does_not_load_data(large_jfc):
+    for db_flashcard in large_jfc.flashcards.limit(20):
+        db_flashcard.filenames
+        db_flashcard.tags
+        db_flashcard.my_tags
+        for db_cell in db_flashcard.cells:
+            db_cell.tags
+            db_cell.filename
+        db_flashcard.right()
+
+    for db_file in large_jfc.files:
+        db_file.to_dict()
+        db_file.tags
+
+    db_cells = [obj for obj in large_jfc.session.identity_map.values() if isinstance(obj, db.Cell)]
+    assert db_cells
+    assert all(_is_deferred(db_cell) for db_cell in db_cells)
+
+
+def test_deferred_data_saves_memory(large_jfc):
+    deferred_size, db_cells = _traced_memory(lambda: large_jfc.cells.all())
+    assert all(_is_deferred(db_cell) for db_cell in db_cells)
+    del db_cells
+    large_jfc.session.close()
+
+    undeferred_size, db_cells = _traced_memory(lambda: large_jfc.cells.options(undefer(db.Cell.data)).all())
+    assert not any(_is_deferred(db_cell) for db_cell in db_cells)
+    del db_cells
+    large_jfc.session.close()
+
+    assert deferred_size * 4 < undeferred_size
+
+
+def test_page_with_content_loads_data(large_jfc):
+    db_flashcards, _ = large_jfc.search_flashcards_page(page_size=20)
+    assert all(_is_deferred(db_cell) for db_flashcard in db_flashcards for db_cell in db_flashcard.cells)
+    large_jfc.session.close()
+
+    page_size, (db_flashcards, _) = _traced_memory(
+        lambda: large_jfc.search_flashcards_page(page_size=20, with_content=True))
+    assert not any(_is_deferred(db_cell) for db_flashcard in db_flashcards for db_cell in db_flashcard.cells)
+    assert page_size > 20 * 20000
+
+
+def test_load_data_in_bulk(large_jfc):
+    db_cells = large_jfc.cells.limit(50).all()
+    assert all(_is_deferred(db_cell) for db_cell in db_cells)
+
+    db.Cell.load_data(db_cells)
+    assert not any(_is_deferred(db_cell) for db_cell in db_cells)
+
+
+def test_load_data_in_the_session_of_the_cells(large_jfc):
+    other = JupyterFlashcard(engine=str(large_jfc.engine.url), user='other', parse_cache_path=None)
+
+    db_cells = large_jfc.cells.limit(50).all()
+    db.Cell.load_data(db_cells)
+
+    assert not any(_is_deferred(db_cell) for db_cell in db_cells)
+    assert not other.session.identity_map
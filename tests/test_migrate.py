@@ -0,0 +1,132 @@
+from datetime import datetime
+import re
+
+import sqlalchemy as sa
+import pytest
+
+from jupyter_flashcard import JupyterFlashcard, db, migrate
+
+SCHEMA_0_1_2 = [
+    '''CREATE TABLE file (
+        id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, checksum VARCHAR NOT NULL,
+        updated DATETIME DEFAULT (CURRENT_TIMESTAMP), tags_str VARCHAR(100),
+        PRIMARY KEY (id))''',
+    '''CREATE TABLE flashcard (
+        id INTEGER NOT NULL, modified DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        srs_level INTEGER DEFAULT '0', next_review DATETIME DEFAULT (CURRENT_TIMESTAMP), tags_str VARCHAR(100),
+        PRIMARY KEY (id))''',
+    '''CREATE TABLE cell (
+        id INTEGER NOT NULL, modified DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        data VARCHAR(50000) NOT NULL, file_id INTEGER NOT NULL, tags_str VARCHAR(100),
+        PRIMARY KEY (id), FOREIGN KEY(file_id) REFERENCES file (id))''',
+    '''CREATE TABLE flashcard_cell_connect (
+        id INTEGER NOT NULL, flashcard_id INTEGER NOT NULL, cell_id INTEGER NOT NULL, type_ VARCHAR(10) NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(flashcard_id) REFERENCES flashcard (id), FOREIGN KEY(cell_id) REFERENCES cell (id))''',
+    "INSERT INTO file (id, name, checksum) VALUES (1, '/notebooks/a.ipynb', 'd41d8cd98f00b204e9800998ecf8427e')",
+    "INSERT INTO cell (id, data, file_id) VALUES (1, '# Q', 1), (2, 'A', 1)",
+    "INSERT INTO flashcard (id, srs_level, next_review) VALUES (1, 3, '2030-01-01 00:00:00.000000'), (2, 0, NULL)",
+    "INSERT INTO flashcard_cell_connect (flashcard_id, cell_id, type_) VALUES (1, 1, 'FRONT'), (1, 2, 'BACK')"
+]
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = sa.create_engine('sqlite:///{}'.format(tmp_path / 'legacy.db'))
+    with engine.begin() as conn:
+        for statement in SCHEMA_0_1_2:
+            conn.execute(statement)
+
+    return engine
+
+
+def test_upgrade_from_0_1_2(legacy_engine):
+    with legacy_engine.connect() as conn:
+        assert migrate.get_version(conn) == 1
+
+    assert migrate.upgrade(legacy_engine, user='alice') == migrate.LATEST_VERSION
+
+    with legacy_engine.connect() as conn:
+        assert migrate.get_version(conn) == migrate.LATEST_VERSION
+        assert conn.execute('SELECT user_id, flashcard_id, srs_level FROM review ORDER BY flashcard_id').fetchall() \
+            == [('alice', 1, 3), ('alice', 2, 0)]
+
+    assert migrate.upgrade(legacy_engine, user='bob') == migrate.LATEST_VERSION
+
+    with legacy_engine.connect() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM review').scalar() == 2
+
+
+def test_upgraded_database_is_usable(legacy_engine):
+    jfc = JupyterFlashcard(engine=str(legacy_engine.url), user='alice', parse_cache_path=None)
+
+    db_flashcard = jfc.flashcards.get(1)
+    assert db_flashcard.srs_level == 3
+    assert [db_cell.data for db_cell in db_flashcard.backs] == ['A']
+
+
+def test_create_empty_database(tmp_path):
+    engine = sa.create_engine('sqlite:///{}'.format(tmp_path / 'new.db'))
+
+    assert migrate.upgrade(engine, create=False) == 0
+    assert migrate.upgrade(engine) == migrate.LATEST_VERSION
+
+    with engine.connect() as conn:
+        assert migrate.get_version(conn) == migrate.LATEST_VERSION
+
+
+def _query_plans(engine, action):
+    """EXPLAIN QUERY PLAN of each SELECT emitted by action()"""
+
+    statements = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    sa.event.listen(engine, 'before_cursor_execute', _capture)
+    try:
+        action()
+    finally:
+        sa.event.remove(engine, 'before_cursor_execute', _capture)
+
+    assert statements
+
+    with engine.connect() as conn:
+        return [(statement, ' '.join(str(row[-1]) for row in conn.execute('EXPLAIN QUERY PLAN ' + statement,
+                                                                          parameters)))
+                for statement, parameters in statements]
+
+
+def _fresh(jfc, model, id_):
+    jfc.session.close()
+
+    return jfc.session.query(model).get(id_)
+
+
+@pytest.mark.parametrize('action, table, index', [
+    (lambda jfc: list(jfc.search_flashcards(due=datetime.now())),
+     'review', 'ix_review_user_id_next_review'),
+    (lambda jfc: jfc.search_flashcards_page(due=datetime.now(), order_by='next_review'),
+     'review', 'ix_review_user_id_next_review'),
+    (lambda jfc: _fresh(jfc, db.Flashcard, 1).flashcard_cell_connects,
+     'flashcard_cell_connect', 'ix_flashcard_cell_connect_flashcard_id'),
+    (lambda jfc: _fresh(jfc, db.Cell, 1).flashcard_cell_connects,
+     'flashcard_cell_connect', 'ix_flashcard_cell_connect_cell_id'),
+    (lambda jfc: _fresh(jfc, db.File, 1).cells,
+     'cell', 'ix_cell_file_id'),
+    (lambda jfc: _fresh(jfc, db.Cell, 1).file_,
+     'file', 'PRIMARY KEY'),
+    (lambda jfc: _fresh(jfc, db.File, 1)._import_cells(['# Q', 'A']),
+     'cell', 'ix_cell_file_id')
+])
+def test_query_plan_uses_index(legacy_engine, action, table, index):
+    jfc = JupyterFlashcard(engine=str(legacy_engine.url), user='alice', parse_cache_path=None)
+
+    plans = [plan for statement, plan in _query_plans(jfc.engine, lambda: action(jfc))
+             if re.search(r'\b(FROM|JOIN) {}\b'.format(table), statement)]
+    jfc.session.rollback()
+
+    assert plans
+    for plan in plans:
+        assert re.search(r'SEARCH {} USING (COVERING |INTEGER )?(INDEX {}|{})'.format(table, index, index), plan), plan
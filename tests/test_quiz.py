@@ -0,0 +1,63 @@
+import gc
+
+import IPython.display
+
+from jupyter_flashcard import JupyterFlashcard
+
+from conftest import write_notebook
+
+
+def _displayed(monkeypatch):
+    displayed = []
+
+    def _display(*objs, **kwargs):
+        for obj in objs:
+            displayed.append(obj['text/markdown'] if kwargs.get('raw') else obj.data)
+
+    monkeypatch.setattr(IPython.display, 'display', _display)
+
+    return displayed
+
+
+def test_prefetch_renders_each_side_once(tmp_path, notebook_dir, monkeypatch):
+    displayed = _displayed(monkeypatch)
+
+    jfc = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'test.db'), parse_cache_path=None)
+    jfc.init(notebook_dir)
+
+    with jfc.iter_quiz(prefetch=2) as iter_quiz:
+        db_flashcard = next(iter_quiz)
+
+    assert db_flashcard.rendered is not None
+
+    db_flashcard.hide()
+    db_flashcard.show()
+    assert db_flashcard.rendered is None
+    assert displayed == [db_cell.data for db_cell in db_flashcard.fronts + db_flashcard.backs]
+
+    db_file = db_flashcard.fronts[0].file_
+    cells = [db_cell.data for db_cell in db_file.cells]
+    cells[cells.index(db_flashcard.backs[0].data)] += ' changed'
+    write_notebook(db_file.path, cells)
+    db_file.update()
+
+    displayed.clear()
+    db_flashcard.show()
+    assert displayed[0].endswith(' changed')
+
+
+def test_prefetch_stops_when_dropped(tmp_path, notebook_dir):
+    jfc = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'test.db'), parse_cache_path=None)
+    jfc.init(notebook_dir)
+
+    iter_quiz = jfc.iter_quiz(prefetch=1)
+    next(iter_quiz)
+    thread = iter_quiz._thread
+    stop = iter_quiz._stop
+
+    del iter_quiz
+    gc.collect()
+    assert stop.is_set()
+
+    thread.join(timeout=5)
+    assert not thread.is_alive()
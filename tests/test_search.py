@@ -0,0 +1,212 @@
+from datetime import datetime, timedelta
+import base64
+
+import pytest
+
+from jupyter_flashcard import JupyterFlashcard, db
+from jupyter_flashcard.config import config
+
+
+@pytest.fixture
+def jfc(tmp_path, notebook_dir):
+    jfc = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'test.db'), parse_cache_path=None)
+    jfc.init(notebook_dir)
+
+    db_flashcards = jfc.flashcards.order_by(db.Flashcard.id).all()
+    db_flashcards[0].mark('Gamma')
+    db_flashcards[1].right()
+    db_flashcards[2].wrong()
+    db_flashcards[6].backs[0].mark('beta')
+    db_flashcards[0].fronts[0].file_.mark('Alpha')
+
+    return jfc
+
+
+def _files(jfc, filename=None, tags=None):
+    """search_files() of version 0.1.2"""
+
+    return {db_file.id for db_file in jfc.files
+            if (not filename or filename in db_file.name)
+            and (not tags or all(tag in db_file.tags for tag in tags))}
+
+
+def _flashcards(jfc, content=None, min_srs=0, max_srs=None, due=None, tags=None, filename=None):
+    """search_flashcards() of version 0.1.2"""
+
+    if not max_srs:
+        max_srs = len(config['srs']) + 1
+
+    if isinstance(due, timedelta):
+        due = datetime.now() + due
+
+    return {db_flashcard.id for db_flashcard in jfc.flashcards
+            if (not content or any(content in db_cell.data for db_cell in db_flashcard.cells))
+            and min_srs <= db_flashcard.srs_level <= max_srs
+            and (not due or db_flashcard.next_review <= due)
+            and (not tags or any(tag in t for tag in tags for t in db_flashcard.tags))
+            and (not filename or any(filename in fn for fn in db_flashcard.filenames))}
+
+
+def _cells(jfc, content=None, filename=None, tags=None):
+    """search_cells() of version 0.1.2"""
+
+    return {db_cell.id for db_cell in jfc.cells
+            if (not content or content in db_cell.data)
+            and (not filename or filename in db_cell.filename)
+            and (not tags or any(tag in t for tag in tags for t in db_cell.tags))}
+
+
+def _all_pages(search_page, page_size, **kwargs):
+    items = []
+    cursor = None
+    while True:
+        page, cursor = search_page(page_size=page_size, cursor=cursor, **kwargs)
+        assert len(page) <= page_size
+
+        items.extend(page)
+        if cursor is None:
+            return items
+
+        assert len(page) == page_size
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(filename='n1'),
+    dict(filename='N1'),
+    dict(tags=['Alpha']),
+    dict(tags=['alpha']),
+    dict(tags=['Alph']),
+    dict(tags=['deck', 'beta']),
+    dict(tags=['deck', 'Alpha']),
+    dict(tags=['nothing']),
+    dict(filename='deck', tags=['Alpha'])
+])
+def test_search_files(jfc, kwargs):
+    expected = _files(jfc, **kwargs)
+
+    assert {db_file.id for db_file in jfc.search_files(**kwargs)} == expected
+    assert {db_file.id for db_file in _all_pages(jfc.search_files_page, 1, **kwargs)} == expected
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(content='Q 1-'),
+    dict(content='q 1-'),
+    dict(content='A 2-3'),
+    dict(min_srs=1),
+    dict(max_srs=1),
+    dict(due=timedelta(days=1)),
+    dict(due=timedelta(minutes=-1)),
+    dict(due=timedelta(minutes=5)),
+    dict(tags=['Gamma']),
+    dict(tags=['gamma']),
+    dict(tags=['bet']),
+    dict(tags=['Alpha', 'beta']),
+    dict(tags=['deck']),
+    dict(filename='n2'),
+    dict(filename='N2'),
+    dict(content='Q', tags=['Alpha'], filename='deck', due=timedelta(minutes=5))
+])
+def test_search_flashcards(jfc, kwargs):
+    expected = _flashcards(jfc, **kwargs)
+
+    assert {db_flashcard.id for db_flashcard in jfc.search_flashcards(**kwargs)} == expected
+    for order_by in ('id', 'modified', 'next_review'):
+        assert {db_flashcard.id for db_flashcard
+                in _all_pages(jfc.search_flashcards_page, 4, order_by=order_by, **kwargs)} == expected
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(content='A 1-'),
+    dict(content='a 1-'),
+    dict(filename='n0'),
+    dict(filename='N0'),
+    dict(tags=['beta']),
+    dict(tags=['Beta']),
+    dict(tags=['Alp', 'beta']),
+    dict(content='Q', filename='deck', tags=['Alpha'])
+])
+def test_search_cells(jfc, kwargs):
+    expected = _cells(jfc, **kwargs)
+
+    assert {db_cell.id for db_cell in jfc.search_cells(**kwargs)} == expected
+    for order_by in ('id', 'modified'):
+        assert {db_cell.id for db_cell
+                in _all_pages(jfc.search_cells_page, 4, order_by=order_by, **kwargs)} == expected
+
+
+def test_pages_in_order_of_id(jfc):
+    db_cells = _all_pages(jfc.search_cells_page, 4)
+
+    assert [db_cell.id for db_cell in db_cells] == sorted(db_cell.id for db_cell in jfc.cells)
+
+
+@pytest.mark.parametrize('page_size', [1, 2, 3, 7])
+def test_ties_across_pages(jfc, page_size):
+    db_flashcards = jfc.flashcards.order_by(db.Flashcard.id).all()
+    tie = datetime(2020, 1, 1)
+
+    # Stored both with and without microseconds, like Python and CURRENT_TIMESTAMP defaults
+    jfc.session.execute("UPDATE flashcard SET modified = '2020-01-01 00:00:00'")
+    jfc.session.execute("UPDATE flashcard SET modified = '2020-01-01 00:00:00.000000' WHERE id % 2 = 0")
+    for db_flashcard in db_flashcards[:-3]:
+        db_flashcard.next_review = tie
+    jfc.session.commit()
+
+    by_next_review = _all_pages(jfc.search_flashcards_page, page_size, order_by='next_review')
+    assert [db_flashcard.id for db_flashcard in by_next_review] \
+        == [db_flashcard.id for db_flashcard
+            in sorted(db_flashcards, key=lambda db_flashcard: (db_flashcard.next_review, db_flashcard.id))]
+
+    by_modified = _all_pages(jfc.search_flashcards_page, page_size, order_by='modified')
+    assert sorted(db_flashcard.id for db_flashcard in by_modified) == [db_flashcard.id for db_flashcard in db_flashcards]
+    assert len(by_modified) == len(db_flashcards)
+
+
+def test_cursor_round_trip(jfc):
+    page, cursor = jfc.search_flashcards_page(page_size=2, order_by='next_review')
+    next_page, _ = jfc.search_flashcards_page(page_size=2, cursor=cursor, order_by='next_review')
+
+    assert len(next_page) == 2
+    assert not {db_flashcard.id for db_flashcard in page} & {db_flashcard.id for db_flashcard in next_page}
+
+    again, _ = jfc.search_flashcards_page(page_size=2, cursor=cursor, order_by='next_review')
+    assert again == next_page
+
+
+def test_last_page_has_no_cursor(jfc):
+    page, cursor = jfc.search_files_page(page_size=3)
+
+    assert len(page) == 3
+    assert cursor is None
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    base64.urlsafe_b64encode(b'[1, 2]').decode(),
+    base64.urlsafe_b64encode(b'["modified", {"datetime": "yesterday"}, 1]').decode(),
+    base64.urlsafe_b64encode(b'["modified", {"date": "2020-01-01"}, 1]').decode()
+])
+def test_invalid_cursor(jfc, cursor):
+    with pytest.raises(ValueError):
+        jfc.search_cells_page(cursor=cursor, order_by='modified')
+
+
+def test_mismatched_cursor(jfc):
+    _, cursor = jfc.search_cells_page(page_size=2, order_by='modified')
+
+    with pytest.raises(ValueError):
+        jfc.search_cells_page(page_size=2, cursor=cursor, order_by='id')
+
+
+def test_invalid_order_by(jfc):
+    with pytest.raises(ValueError):
+        jfc.search_cells_page(order_by='data')
+
+
+@pytest.mark.parametrize('page_size', [0, -1])
+def test_invalid_page_size(jfc, page_size):
+    with pytest.raises(ValueError):
+        jfc.search_cells_page(page_size=page_size)
@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+import pytest
+
+from jupyter_flashcard import JupyterFlashcard, db
+
+from conftest import write_notebook
+
+
+@pytest.fixture
+def jfc(tmp_path, notebook_dir):
+    jfc = JupyterFlashcard(engine='sqlite:///{}'.format(tmp_path / 'test.db'), parse_cache_path=None)
+    jfc.init(notebook_dir)
+
+    return jfc
+
+
+@pytest.fixture
+def snapshot(jfc):
+    return jfc.load_snapshot()
+
+
+def _card_ids(db_file):
+    return {fcc.flashcard_id for db_cell in db_file.cells for fcc in db_cell.flashcard_cell_connects}
+
+
+def test_load(jfc, snapshot):
+    assert set(snapshot.cards.keys()) == {db_flashcard.id for db_flashcard in jfc.flashcards}
+
+    db_flashcard = jfc.flashcards.first()
+    record = snapshot.get(db_flashcard.id)
+    assert record.front_ids == tuple(db_cell.id for db_cell in db_flashcard.fronts)
+    assert record.back_ids == tuple(db_cell.id for db_cell in db_flashcard.backs)
+    assert set(record.tags) == set(db_flashcard.tags)
+    assert set(record.filenames) == set(db_flashcard.filenames)
+
+
+def test_review_marks_only_the_card_stale(jfc, snapshot):
+    db_flashcard, other = jfc.flashcards.limit(2).all()
+    other_record = snapshot.get(other.id)
+
+    db_flashcard.right()
+    assert snapshot._stale == {db_flashcard.id}
+
+    assert snapshot.get(db_flashcard.id).srs_level == 1
+    assert snapshot.get(other.id) is other_record
+    assert not snapshot._stale
+
+
+def test_tags_mark_only_the_affected_cards_stale(jfc, snapshot):
+    db_flashcard = jfc.flashcards.first()
+
+    db_flashcard.mark()
+    assert snapshot._stale == {db_flashcard.id}
+    assert 'marked' in snapshot.get(db_flashcard.id).tags
+
+    db_cell = jfc.flashcards.get(db_flashcard.id + 1).backs[0]
+    db_cell.mark()
+    assert snapshot._stale == {fcc.flashcard_id for fcc in db_cell.flashcard_cell_connects}
+    assert 'marked' in snapshot.get(db_flashcard.id + 1).tags
+
+
+def test_file_update_marks_only_its_cards_stale(jfc, snapshot):
+    db_file, other_file = jfc.files.limit(2).all()
+    other_records = {card_id: snapshot.get(card_id) for card_id in _card_ids(other_file)}
+
+    cells = [db_cell.data for db_cell in db_file.cells]
+    cells[1] += ' changed'
+    write_notebook(db_file.path, cells)
+    db_file.update()
+
+    assert snapshot._stale
+    assert snapshot._stale <= _card_ids(db_file)
+
+    snapshot.refresh()
+    assert all(snapshot.get(card_id) is record for card_id, record in other_records.items())
+
+
+def test_deleted_card_disappears(jfc, snapshot):
+    db_flashcard = jfc.flashcards.first()
+    card_id = db_flashcard.id
+
+    for db_fcc in db_flashcard.flashcard_cell_connects:
+        jfc.session.delete(db_fcc)
+    jfc.session.delete(db_flashcard)
+    jfc.session.commit()
+
+    assert snapshot.get(card_id) is None
+    assert card_id not in {record.id for record in snapshot.filter()}
+
+
+def test_snapshot_quiz_skips_deleted_cards(jfc, snapshot):
+    iter_quiz = jfc.iter_quiz()
+
+    for db_flashcard in jfc.flashcards:
+        for db_fcc in db_flashcard.flashcard_cell_connects:
+            jfc.session.delete(db_fcc)
+        jfc.session.delete(db_flashcard)
+    jfc.session.commit()
+
+    assert list(iter_quiz) == []
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(due=timedelta(0)),
+    dict(due=timedelta(days=1)),
+    dict(due=timedelta(minutes=-1)),
+    dict(min_srs=1),
+    dict(max_srs=1),
+    dict(tags=['deck']),
+    dict(tags=['Deck']),
+    dict(tags=['marked']),
+    dict(tags=['eck', 'nothing']),
+    dict(filename='n1'),
+    dict(filename='N1'),
+    dict(filename='n1', tags=['marked'], due=timedelta(0))
+])
+def test_filter_matches_search_flashcards(jfc, snapshot, kwargs):
+    db_flashcards = jfc.flashcards.order_by(db.Flashcard.id).all()
+    db_flashcards[0].right()
+    db_flashcards[1].wrong()
+    db_flashcards[2].mark()
+    db_flashcards[6].backs[0].mark()
+
+    assert {record.id for record in snapshot.filter(**kwargs)} \
+        == {db_flashcard.id for db_flashcard in jfc.search_flashcards(**kwargs)}
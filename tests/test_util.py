@@ -0,0 +1,19 @@
+import hashlib
+
+from jupyter_flashcard.util import get_checksum, is_checksum
+
+
+def test_checksum_is_blake2b():
+    checksum = get_checksum(b'data')
+
+    assert checksum == 'blake2b:' + hashlib.blake2b(b'data').hexdigest()
+    assert is_checksum(checksum, b'data')
+    assert not is_checksum(checksum, b'other data')
+
+
+def test_legacy_md5_checksum():
+    checksum = hashlib.md5(b'data').hexdigest()
+
+    assert get_checksum(b'data', 'md5') == checksum
+    assert is_checksum(checksum, b'data')
+    assert not is_checksum(checksum, b'other data')